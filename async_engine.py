@@ -0,0 +1,166 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError
+import decoder
+from network import (HTTP_RETRIES, RETRY_STATUSES, host_limiter,
+                     retry_delay)
+from scraper import PAGE_SIZE, SCRAPE_HEADERS, parse_inventory_table
+try:
+    import aiohttp
+except ImportError:
+    # Without aiohttp scraping and decoding stay on thread pools
+    aiohttp = None
+
+
+# Max requests in flight at once across every yard and decode
+ASYNC_CONCURRENCY = 500
+# Max open connections per host
+ASYNC_CONNECTIONS_PER_HOST = 32
+
+
+# Runs scraping and VIN decoding on one asyncio event loop in a background
+# thread. Any thread can hand it work with run(), requests from all callers
+# share one semaphore and connection pool, and cancel() stops everything
+# that's still in flight.
+class AsyncEngine:
+    def __init__(self,
+                 concurrency=ASYNC_CONCURRENCY,
+                 connections_per_host=ASYNC_CONNECTIONS_PER_HOST
+                 ):
+        if aiohttp is None:
+            raise ImportError('AsyncEngine needs aiohttp installed')
+        self.concurrency = concurrency
+        self.connections_per_host = connections_per_host
+        self.semaphore = None
+        self.session = None
+        self.futures = set()
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True
+                                       )
+        self.thread.start()
+
+    # Runs a coroutine on the engine's loop and waits for its result.
+    # Raises CancelledError if cancel() is called before or while it runs.
+    def run(self, coroutine):
+        with self.lock:
+            if self.cancelled:
+                coroutine.close()
+                raise CancelledError()
+            future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+            self.futures.add(future)
+        try:
+            return future.result()
+        finally:
+            with self.lock:
+                self.futures.discard(future)
+
+    # Stops all running work, and any new work until reset() is called
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            for future in self.futures:
+                future.cancel()
+
+    def reset(self):
+        with self.lock:
+            self.cancelled = False
+
+    def close(self):
+        if self.session is not None:
+            asyncio.run_coroutine_threadsafe(self.session.close(),
+                                             self.loop
+                                             ).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    # Created on first use, they have to belong to the engine's loop
+    def start_session(self):
+        if self.session is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency,
+                limit_per_host=self.connections_per_host
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    # Sends one request, returns (status code, body). The body is parsed
+    # JSON when as_json is set and the request succeeded. Connection errors
+    # and 429/5xx responses are retried like http_session does, up to
+    # HTTP_RETRIES times with backoff or the server's Retry-After.
+    async def request(self, method, url, as_json=False, **kwargs):
+        session = self.start_session()
+        for attempt in range(HTTP_RETRIES + 1):
+            last_attempt = attempt == HTTP_RETRIES
+            # Waits its turn for the host before taking a slot, so requests
+            # held back by one host's rate limit don't block other hosts
+            await asyncio.sleep(host_limiter.reserve(url))
+            async with self.semaphore:
+                try:
+                    async with session.request(method, url,
+                                               **kwargs) as response:
+                        if (response.status in RETRY_STATUSES
+                                and not last_attempt):
+                            delay = retry_delay(
+                                attempt, response.headers.get('Retry-After')
+                            )
+                        elif response.status != 200:
+                            return response.status, None
+                        elif as_json:
+                            return response.status, await response.json(
+                                content_type=None
+                            )
+                        else:
+                            return response.status, await response.read()
+                except aiohttp.ClientError as error:
+                    if last_attempt:
+                        return f'{type(error).__name__}: {error}', None
+                    delay = retry_delay(attempt)
+            # Waits without holding a slot other requests could use
+            await asyncio.sleep(delay)
+
+    # Scrapes yard inventory pages, calling
+    # on_page(page_index, status code, table) as each one finishes
+    async def scrape_pages(self, url, page_indexes, on_page):
+        async def scrape(page_index):
+            url_index = url + f'?start={1 + page_index * PAGE_SIZE}'
+            status_code, content = await self.request('GET',
+                                                      url_index,
+                                                      headers=SCRAPE_HEADERS
+                                                      )
+            table = None
+            if content is not None:
+                table = parse_inventory_table(content)
+            on_page(page_index, status_code, table)
+
+        await gather_or_cancel(scrape(page_index)
+                               for page_index in page_indexes)
+
+    # Sends VIN batches to the NHTSA batch endpoint, calling
+    # on_batch(batch, decode_data) as each one finishes
+    async def decode_batches(self, batches, on_batch):
+        async def decode(batch):
+            status_code, data = await self.request('POST',
+                                                   decoder.batch_url(),
+                                                   as_json=True,
+                                                   data=decoder.batch_form(
+                                                       batch
+                                                   ))
+            on_batch(batch, decoder.batch_results(status_code, data))
+
+        await gather_or_cancel(decode(batch) for batch in batches)
+
+
+# Runs coroutines together. If one fails or the caller is cancelled, the
+# rest are cancelled too instead of being left running.
+async def gather_or_cancel(coroutines):
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        await asyncio.gather(*tasks)
+    except (Exception, asyncio.CancelledError):
+        for task in tasks:
+            task.cancel()
+        raise
@@ -0,0 +1,67 @@
+import sys
+import timeit
+from io import StringIO
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+import scraper
+
+# Compares the lxml table parser against the old BeautifulSoup + read_html
+# path. Pass saved yard pages as arguments, or run without arguments to use a
+# generated 50 vehicle page.
+#   python benchmark_parse.py data_cache/spokane_page.html
+
+
+def old_parse(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    tables = soup.find('table', 'table')
+    df1 = pd.read_html(StringIO(str(tables)))
+    out_put = df1[0]
+    return out_put[['Row', 'Vin', 'Year', 'Make', 'Model']]
+
+
+def sample_page():
+    rows = ''.join(
+        f'<tr><td>{row % 80 + 1}</td>'
+        f'<td><a href="#">JF1BE6{row:011d}</a></td>'
+        f'<td>{1995 + row % 20}</td><td>SUBARU</td><td>LEGACY</td>'
+        f'<td>2024-05-{row % 28 + 1:02d}</td></tr>'
+        for row in range(50)
+    )
+    return (
+        '<html><body>'
+        '<input class="form-control"><input class="form-control" '
+        'data-pagecount="40">'
+        '<table class="table table-striped"><thead><tr><th>Row</th>'
+        '<th>Vin</th><th>Year</th><th>Make</th><th>Model</th>'
+        '<th>Date Set</th></tr></thead>'
+        f'<tbody>{rows}</tbody></table></body></html>'
+    ).encode()
+
+
+if __name__ == '__main__':
+    pages = [open(file, 'rb').read() for file in sys.argv[1:]]
+    if not pages:
+        pages = [sample_page()]
+
+    for page in pages:
+        old_table = old_parse(page).reset_index(drop=True)
+        new_table = scraper.parse_inventory_table(page)
+        print('Same output:',
+              old_table.astype(str).equals(new_table.astype(str)))
+
+    loops = 50
+    old_time = timeit.timeit(lambda: [old_parse(page) for page in pages],
+                             number=loops
+                             )
+    new_time = timeit.timeit(
+        lambda: [scraper.parse_inventory_table(page) for page in pages],
+        number=loops
+    )
+    per_page = loops * len(pages)
+    print(f'BeautifulSoup + read_html: {old_time / per_page * 1000:.2f} '
+          f'ms/page')
+    print(f'lxml single pass:          {new_time / per_page * 1000:.2f} '
+          f'ms/page')
+    print(f'Speedup: {old_time / new_time:.1f}x')
@@ -0,0 +1,68 @@
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import inventory
+from inventory import Query
+
+# Compares indexed Inventory lookups against full-column scans on a
+# synthetic multi-yard inventory.
+#   python benchmark_search.py
+
+ROWS = 1_000_000
+MAKES = {
+    'SUBARU': ['LEGACY', 'IMPREZA', 'FORESTER', 'OUTBACK'],
+    'TOYOTA': ['CAMRY', 'COROLLA', 'TACOMA', '4RUNNER'],
+    'CHEVROLET': ['SILVERADO', 'MALIBU', 'TAHOE', 'IMPALA'],
+    'FORD': ['F150', 'TAURUS', 'EXPLORER', 'FOCUS'],
+    'HONDA': ['ACCORD', 'CIVIC', 'CR-V', 'ODYSSEY'],
+}
+
+
+def synthetic_inventory(rows=ROWS):
+    rng = np.random.default_rng(0)
+    makes = rng.choice(list(MAKES), rows)
+    models = [MAKES[make][choice]
+              for make, choice in zip(makes, rng.integers(0, 4, rows))]
+    return pd.DataFrame({
+        'Row': rng.integers(1, 120, rows),
+        'Vin': [f'VIN{number:014d}' for number in range(rows)],
+        'Year': rng.integers(1985, 2020, rows),
+        'Make': makes,
+        'Model': models,
+        'Location': rng.choice(['Spokane', 'Mead', 'Boise'], rows),
+    })
+
+
+if __name__ == '__main__':
+    raw = synthetic_inventory()
+    load_time = timeit.timeit(
+        lambda: inventory.Inventory('Synthetic_inventory.csv', raw), number=1
+    )
+    indexed_inventory = inventory.Inventory('Synthetic_inventory.csv', raw)
+    print(f'{ROWS} rows, building indexes took {load_time:.2f}s')
+
+    queries = {
+        'make': Query(make='subaru'),
+        'make + model': Query(make='subaru', model='legacy'),
+        'year + make + model': Query(year=2004, make='subaru',
+                                     model='legacy'),
+        'year range + make': Query(year='2000-2005', make='toyota'),
+    }
+    for name, query in queries.items():
+        predicates = query.inventory_predicates()
+
+        def scan():
+            return int(Query.mask(raw, predicates).sum())
+
+        def indexed():
+            indexed_inventory.positions_cache.clear()
+            return indexed_inventory.count(query)
+
+        assert scan() == indexed()
+        scan_time = timeit.timeit(scan, number=10) / 10
+        index_time = timeit.timeit(indexed, number=10) / 10
+        print(f'{name:22} scan {scan_time * 1000:8.2f} ms   '
+              f'indexed {index_time * 1000:8.2f} ms   '
+              f'({scan_time / index_time:.0f}x)')
@@ -0,0 +1,135 @@
+import os
+import tempfile
+
+import decoder
+from decoder import DecodeResult
+from nhtsa_server import server_url, start_server
+
+# Checks VIN decoding against the local NHTSA stand-in (nhtsa_server.py)
+# instead of the real API, and offline decoding against the sample pattern
+# table. Runs in a temporary folder so the real data_cache is left alone.
+#   python check_decoder.py
+
+SAMPLE_PATTERNS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'sample_vpic_patterns.csv'
+                               )
+
+SUBARU = DecodeResult(liters=2.457278, cylinders='4', engine_model='EJ25',
+                      fuel_type='Gasoline', transmission='Automatic',
+                      drive_type='AWD', trim='GT')
+TOYOTA = DecodeResult(liters=2.995, cylinders='6', engine_model='1MZ-FE',
+                      fuel_type='Gasoline', transmission='Automatic',
+                      drive_type='FWD', trim='XLE')
+
+
+def sample_vins(prefix, count):
+    return [f'{prefix}04{index:07d}' for index in range(count)]
+
+
+def check_single(server):
+    results = decoder.vin_decode('JF1BE6LC045123456')
+    assert DecodeResult.from_results(results) == SUBARU, results
+    assert server.requests[-1] == ('decodevin', 1)
+
+
+def check_batch(server, engine=None):
+    subarus = sample_vins('JF1BE6LC', 60)
+    toyotas = sample_vins('4T1BF22K', 60)
+    unknown = 'ZZZZZZZZ045123456'
+    server.requests.clear()
+    engines = decoder.decode_engine_batch(subarus + toyotas + [unknown],
+                                          engine
+                                          )
+    # One VIN per engine key goes to the API, the rest share its engine
+    assert server.requests == [('batch', 3)], server.requests
+    assert engines[subarus[0]] == SUBARU and engines[toyotas[0]] == TOYOTA
+    assert all(engines[vin].engine() == SUBARU.engine() for vin in subarus)
+    assert engines[unknown] == DecodeResult()
+    # Only the real decodes are cached, shared copies are rebuilt from them
+    assert len(decoder.vin_cache.all_engines()) == 3
+
+    server.requests.clear()
+    again = decoder.decode_engine_batch(subarus + toyotas, engine)
+    assert server.requests == [], server.requests
+    assert all(again[vin].engine() == engines[vin].engine()
+               for vin in subarus + toyotas)
+
+
+# VINs decoded with share=False each get their own full decode
+def check_unshared(server, engine=None):
+    subarus = sample_vins('JF1BE6LC', 3)
+    server.requests.clear()
+    engines = decoder.decode_engine_batch(subarus, engine, share=False)
+    assert server.requests == [('batch', 2)], server.requests
+    assert all(engines[vin] == SUBARU for vin in subarus), engines
+
+
+def check_throttled(server, engine=None):
+    server.requests.clear()
+    server.throttle = 2
+    engines = decoder.decode_engine_batch(sample_vins('1G1ND52J', 5), engine)
+    assert len(engines) == 5, engines
+    assert server.requests == [('batch', 1)] * 3, server.requests
+
+
+# Offline decoding from sample_vpic_patterns.csv, which has exact rows, a
+# '*' row for every Camry year and an exact row that overrides it
+def check_patterns(server):
+    offline = decoder.OfflineDecoder()
+    offline.file_path = SAMPLE_PATTERNS
+    assert offline.decode('JF1BE6LC045123456').engine() == (2.5, '4', 'EJ25')
+    assert offline.decode('4T1BF22K0Y1234567').engine() == (3.0, '6',
+                                                            '1MZ-FE')
+    assert offline.decode('4T1BF22K051234567').engine() == (3.3, '6',
+                                                            '3MZ-FE')
+    assert offline.decode('1G1ND52J041234567').engine() == (2.2, '4', 'L61')
+    assert offline.decode('1G1ND52J051234567') is None
+    assert offline.decode('ZZZZZZZZ045123456') is None
+    assert (offline.hits, offline.misses) == (4, 2)
+
+    # Makes with their own engine key skip the table
+    decoder.ENGINE_KEY_MAKES['SUBARU'] = None
+    try:
+        assert offline.decode('JF1BE6LC045123456', 'SUBARU') is None
+    finally:
+        del decoder.ENGINE_KEY_MAKES['SUBARU']
+
+    # Covered VINs never reach the API
+    default_decoder = decoder.offline_decoder
+    decoder.offline_decoder = offline
+    try:
+        server.requests.clear()
+        vins = sample_vins('4T1BF22K', 10) + ['JF1BE6LC055123456']
+        engines = decoder.decode_engine_batch(vins)
+    finally:
+        decoder.offline_decoder = default_decoder
+    assert server.requests == [], server.requests
+    assert engines[vins[0]].engine() == (3.0, '6', '1MZ-FE')
+    assert engines[vins[-1]].engine() == (2.5, '4', 'EJ25')
+
+
+if __name__ == '__main__':
+    server = start_server()
+    decoder.NHTSA_API_URL = server_url(server)
+    os.chdir(tempfile.mkdtemp())
+
+    check_single(server)
+    check_batch(server)
+    check_unshared(server)
+    check_throttled(server)
+    print('Decoding with the thread pool: OK')
+    check_patterns(server)
+    print('Decoding offline from the sample pattern table: OK')
+
+    try:
+        from async_engine import AsyncEngine
+        engine = AsyncEngine()
+    except ImportError:
+        print('Skipped the async engine, aiohttp is not installed')
+    else:
+        decoder.vin_cache = decoder.VinCache('async_vin_cache.db')
+        check_batch(server, engine)
+        check_unshared(server, engine)
+        check_throttled(server, engine)
+        engine.close()
+        print('Decoding with the async engine: OK')
@@ -1,71 +1,25 @@
 import threading
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
-from io import StringIO
-import os
+import queue
+import sys
+import time
 import tkinter as tk
 from tkinter import ttk
 import customtkinter as ctk
 from tkinter import messagebox
-
-
-# VIN decode function (NHTSA API)
-def vin_decode(vin):
-    url = (
-        f'https://vpic.nhtsa.dot.gov/api/vehicles/decodevin/{vin}?format=json'
-    )
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if 'Results' in data:
-            results = data['Results']
-            return results
-        else:
-            return 'VIN decoding failed'
-    else:
-        return (
-            f'Error: Failed to fetch data from NHTSA API'
-            f'\nError code: {response.status_code}'
-        )
-
-
-# Gets data from the decoded VIN
-def get_displacement(results):
-    for result in results:
-        if 'Variable' in result and 'Value' in result:
-            if result['Variable'] == 'Displacement (L)':
-                engine_displacement = result['Value']
-                if engine_displacement is None:
-                    engine_displacement = 0.0
-                return round(float(engine_displacement), 1)
-
-
-def get_engine_model(results):
-    for result in results:
-        if 'Variable' in result and 'Value' in result:
-            if result['Variable'] == 'Engine Model':
-                engine_model = result['Value']
-                if engine_model is None:
-                    engine_displacement = 'No info'
-                return engine_model
-
-
-def get_cylinder_count(results):
-    for result in results:
-        if 'Variable' in result and 'Value' in result:
-            if result['Variable'] == 'Engine Number of Cylinders':
-                cylinder_count = result['Value']
-                if cylinder_count:
-                    cylinder_count = cylinder_count
-                return cylinder_count
-
-
-# Count lines in text widget
-def count_lines(text_widget):
-    last_line_index = text_widget.index("end-1c")
-    line_number = last_line_index.split('.')[0]
-    return int(line_number)
+from tkinter import simpledialog
+from async_engine import AsyncEngine, aiohttp
+from inventory import Query, inventory_manager, location_rows
+from scraper import get_yards, make_file
+from watchlist import WATCH_LOG_FILE, load_watches, save_watch
+
+# Result rows inserted into a table per UI tick, the rest are scheduled
+# with after() so large results don't freeze the window
+TABLE_CHUNK_SIZE = 500
+# Milliseconds between chunks, gives Tk time to redraw and handle input
+TABLE_CHUNK_DELAY = 1
+# Milliseconds between runs of the UI queue, progress updates that come in
+# faster than this are only drawn once
+UI_POLL_INTERVAL = 50
 
 
 class App(ctk.CTk):
@@ -97,6 +51,27 @@ class App(ctk.CTk):
         self.menubar = None
         # ---------------
 
+        # Rows waiting to be added to each results table, and the pending
+        # after() job that adds them
+        self.table_rows = {}
+        self.table_jobs = {}
+        # Widget updates from worker threads, run on the main loop by
+        # process_ui_queue(). Tk widgets are only safe to touch from there.
+        self.ui_queue = queue.Queue()
+        # Pages scraped per yard while the inventory is updating, and the
+        # newest progress line that hasn't been drawn yet
+        self.scrape_progress = {}
+        self.progress_line = None
+        self.progress_lock = threading.Lock()
+        # Runs the scraping and VIN decoding requests when aiohttp is
+        # installed, otherwise they go through thread pools
+        self.engine = None
+        if aiohttp is not None:
+            self.engine = AsyncEngine()
+        # Decode every new VIN in the background after an update so engine
+        # searches don't wait on the API
+        self.predecode = tk.BooleanVar(value=False)
+
         self.how_to_use = ('How to use:'
                            '\n-Click File > Update Inventory to get the '
                            '\nlatest yard inventory.'
@@ -106,6 +81,9 @@ class App(ctk.CTk):
                            '\n-If searching for an engine, please provide at'
                            ' least a "Make" parameter. The more parameters '
                            'that are entered, the faster the API call will be.'
+                           '\n-Check File > Decode engines after update to '
+                           'decode every VIN after updating, engine searches '
+                           'then run right away and don\'t need a "Make".'
                            '\n-Please ensure your spelling is correct or the '
                            'functions will not work.'
                            '\n\nNotes:'
@@ -131,6 +109,7 @@ class App(ctk.CTk):
         self.mead_frame()
         self.display_frame()
 
+        self.after(UI_POLL_INTERVAL, self.process_ui_queue)
         self.mainloop()
 
     # Making Widgets
@@ -145,6 +124,22 @@ class App(ctk.CTk):
         self.file_menu.add_command(label="Update Inventory",
                                    command=self.update_inventory_btn_func
                                    )
+        self.file_menu.add_command(label="Quick Update (new arrivals)",
+                                   command=self.quick_update_btn_func
+                                   )
+        self.file_menu.add_command(label="Cancel",
+                                   command=self.cancel_btn_func
+                                   )
+        self.file_menu.add_checkbutton(label="Decode engines after update",
+                                       variable=self.predecode
+                                       )
+        self.file_menu.add_separator()
+        self.file_menu.add_command(label="Save search to watchlist",
+                                   command=self.save_watch_btn_func
+                                   )
+        self.file_menu.add_command(label="Show watchlist",
+                                   command=self.show_watchlist_btn_func
+                                   )
         self.file_menu.add_separator()
         self.file_menu.add_command(label='How to use',
                                    command=self.how_to_use_fuc
@@ -346,11 +341,11 @@ class App(ctk.CTk):
 
     # -----Functions-----
     def dark_theme_btn_func(self):
-        threading.Thread(target=self.dark_theme).start()
+        self.dark_theme()
         # self.update_text_display("Sorry, this feature is not yet available")
 
     def light_theme_btn_func(self):
-        threading.Thread(target=self.light_theme).start()
+        self.light_theme()
 
     def dark_theme(self):
         ctk.set_appearance_mode('dark')
@@ -394,365 +389,274 @@ class App(ctk.CTk):
                                   fg='black'
                                   )
 
+    # The entries are read here, worker threads can't touch widgets
     def search_btn_func(self):
-        threading.Thread(target=self.search_inventory).start()
-
-    def update_inventory_btn_func(self):
-        threading.Thread(target=self.scrape_inventory).start()
-
-    def make_file(self, location_name, url):
-        init_message = (
-            f'Initializing request for {location_name} location...\n'
+        query = Query(year=self.year_entry.get(),
+                      make=self.make_entry.get(),
+                      model=self.model_entry.get(),
+                      displacement=self.displacement_entry.get(),
+                      cylinders=self.cylinders_entry.get()
+                      )
+        threading.Thread(target=self.search_inventory, args=(query,)).start()
+
+    # Saves the search entries as a watch, new arrivals that match it are
+    # reported after each update
+    def save_watch_btn_func(self):
+        name = simpledialog.askstring('Save search',
+                                      'Name for this search:',
+                                      parent=self
+                                      )
+        if not name:
+            return
+        try:
+            save_watch(name,
+                       year=self.year_entry.get(),
+                       make=self.make_entry.get(),
+                       model=self.model_entry.get(),
+                       displacement=self.displacement_entry.get(),
+                       cylinders=self.cylinders_entry.get()
+                       )
+        except ValueError as error:
+            messagebox.showinfo(title='Invalid search', message=str(error))
+            return
+        self.update_text_display(
+            f'Saved "{name}" to the watchlist.\nNew arrivals that match it '
+            f'are shown after each update and logged to {WATCH_LOG_FILE}'
         )
-        self.write_to_text_display(init_message)
-        print(init_message)
-
-        init_fail = 'Initiation failed!\n'
-        seperator = '\n---------------\n'
-
-        # CALL REQUEST TO WEBSITE
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                          'AppleWebKit/537.36 (KHTML, like Gecko) '
-                          'Chrome/123.0.0.0 Safari/537.36'
-        }
-
-        response = requests.get(url, headers=headers)
-        page_count = None
 
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # GET TOTAL TABLE PAGES
-            input_tags = soup.find_all("input",
-                                       {"class": "form-control"}
-                                       )
-            page_tag = input_tags[1]
-            page_count = int(page_tag.get('data-pagecount'))
+    def show_watchlist_btn_func(self):
+        watches = load_watches()
+        if not watches:
+            self.update_text_display('No saved searches yet.')
+            return
+        self.update_text_display('Watchlist:\n' + '\n'.join(
+            f'{name}: {Query(**filters).describe()}'
+            for name, filters in watches.items()
+        ))
 
+    def update_inventory_btn_func(self):
+        threading.Thread(target=self.scrape_inventory,
+                         kwargs={'predecode': self.predecode.get()}
+                         ).start()
+
+    def quick_update_btn_func(self):
+        threading.Thread(target=self.scrape_inventory,
+                         kwargs={'incremental': True,
+                                 'predecode': self.predecode.get()
+                                 }
+                         ).start()
+
+    # Only the async engine can stop requests that are already running
+    def cancel_btn_func(self):
+        if self.engine is None:
+            self.write_to_text_display(
+                '\nCancelling needs aiohttp installed.'
+            )
         else:
-            # GET REQUEST FAILED
-            get_request_failed = (
-                f"{init_fail}Failed to fetch data from the URL:", url,
-                f"\nResponse Status: {response.status_code}{seperator}")
-            self.write_to_text_display(get_request_failed)
-            print(get_request_failed)
-
-        # TABLE DATA
-        page_data = []
-        page_index = 0
-        start_index = 1
-
-        # LOOP THROUGH ALL TABLE PAGES
-        scraping_message = (
-            f'Scraping {page_count} pages from the '
-            f'{location_name} yard site.\n'
-        )
-        self.write_to_text_display(scraping_message)
-        print(scraping_message)
-
-        while page_count > page_index:
-            url_index = url + f'?start={start_index}'
-            # SCRAPE TABLE DATA
-            response = requests.get(url_index, headers=headers)
-
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.content, 'html.parser')
-                tables = soup.find('table', 'table')
-                df1 = pd.read_html(StringIO(str(tables)))
-                out_put = df1[0]
-
-                table = out_put[['Row', 'Vin', 'Year', 'Make', 'Model']]
-                page_data.append(table)
-                start_index += 50
-                page_index += 1
-                self.scrape_update(
-                    f'\nScraped {page_index}/{page_count} pages'
-                )
-            else:
-                # REQUEST FAILED
-                url_failed_message = (
-                    f"{init_fail}Failed to fetch data from the URL:", url,
-                    f"\nResponse Status: {response.status_code}{seperator}"
+            self.engine.cancel()
+
+    def scrape_inventory(self, incremental=False, predecode=False):
+        try:
+            location_names = list(get_yards())
+        except ValueError as error:
+            self.ui(self.update_text_display, str(error))
+            return
+        if self.engine is not None:
+            self.engine.reset()
+        self.ui(self.clear_tables)
+        self.ui(self.update_text_display, '')
+        with self.progress_lock:
+            self.scrape_progress = {}
+            self.progress_line = None
+        yard_threads = [
+            threading.Thread(target=make_file,
+                             args=(location_name,),
+                             kwargs={'incremental': incremental,
+                                     'report': self.report,
+                                     'progress': self.report_progress,
+                                     'engine': self.engine,
+                                     'predecode': predecode
+                                     }
+                             )
+            for location_name in location_names
+        ]
+        for yard_thread in yard_threads:
+            yard_thread.start()
+        for yard_thread in yard_threads:
+            yard_thread.join()
+        self.ui(self.write_to_text_display, '\nINVENTORY UPDATE FINISHED!')
+
+    def search_inventory(self, query):
+        try:
+            # Yards in the registry that haven't been scraped yet are skipped
+            location_names = [
+                location_name for location_name in get_yards()
+                if inventory_manager.store_mtime(
+                    f'{location_name}_inventory.csv'
                 )
-                self.write_to_text_display(url_failed_message)
-                print(url_failed_message)
-        # ALL YARD DATA
-        yard_inventory = pd.concat(page_data)
-
-        # CREATE A NEW CSV FILE IN DATA_CACHE
-        # ENSURE FOLDER EXISTS
-        if not os.path.exists('data_cache'):
-            os.makedirs('data_cache')
-
-            # CONSTRUCT FULL FILE PATH
-        file_path = os.path.join('data_cache',
-                                 f'{location_name}_inventory.csv'
-                                 )
-
-        # WRITE DATA TO CSV
-        yard_inventory.to_csv(file_path, index=False)
-
-        writing_csv_message = (
-            f'\n{yard_inventory.shape[0]} vehicles written to '
-            f'{location_name}_inventory.csv in data_cache \nfolder.'
-            f'\n{location_name} initiation complete!{seperator}'
-        )
-        self.write_to_text_display(writing_csv_message)
-        print(writing_csv_message)
-
-    def scrape_inventory(self):
-        self.clear_tables()
-        self.update_text_display('')
-        self.make_file('Spokane',
-                       "https://newautopart.net/includes/pullandsave"
-                       "/spokane/yard_locationslist.php"
-                       )
-        self.make_file('Mead',
-                       "https://newautopart.net/includes/pullandsave/mead"
-                       "/yard_locationslist.php"
-                       )
-        self.write_to_text_display('INVENTORY UPDATE FINISHED!')
-
-    def search_inventory(self):  # To do: Add Inventory Class and Search func
+            ]
+        except ValueError as error:
+            self.ui(self.update_text_display, str(error))
+            return
         # Check to see if the inventory has been scraped
-        if not os.path.exists('data_cache'):
+        if not location_names:
             no_data = ('Data not yet scraped!\nPlease update '
                        'the inventory before continuing.')
-            self.update_text_display(no_data)
+            self.ui(self.update_text_display, no_data)
             print(no_data)
         else:
-            spokane_inventory = Inventory('Spokane_inventory.csv')
-            mead_inventory = Inventory('Mead_inventory.csv')
-            year_param = None
-            make_param = None
-            model_param = None
-            displacement_param = None
-            cylinders_param = None
-            if self.year_entry.get():
-                year_param = self.year_entry.get().upper()
-            if self.make_entry.get():
-                make_param = self.make_entry.get().upper()
-            if self.model_entry.get():
-                model_param = self.model_entry.get().upper()
-            if self.displacement_entry.get():
-                displacement_param = self.displacement_entry.get()
-            if self.cylinders_entry.get():
-                cylinders_param = self.cylinders_entry.get()
-            if displacement_param and make_param is None:
-                messagebox.showinfo(
-                    title="Invalid search",
-                    message='Must have a "Make" input to search for Engine'
-                )
-            if cylinders_param and make_param is None:
-                messagebox.showinfo(
-                    title="Invalid search",
-                    message='Must have a "Make" input to search for Engine'
-                )
-            if displacement_param and make_param:
-                spokane_search_count = spokane_inventory.api_search_count(
-                    year=year_param,
-                    make=make_param,
-                    model=model_param
-                )
-                mead_search_count = mead_inventory.api_search_count(
-                    year=year_param,
-                    make=make_param,
-                    model=model_param
-                )
-                self.update_text_display(
-                    f'Sending {spokane_search_count + mead_search_count} '
-                    f'items to the NHTSA API\nThis may take a few moments...'
-                )
-            if cylinders_param and make_param:
-                spokane_search_count = spokane_inventory.api_search_count(
-                    year=year_param,
-                    make=make_param,
-                    model=model_param
-                )
-                mead_search_count = mead_inventory.api_search_count(
-                    year=year_param,
-                    make=make_param,
-                    model=model_param
-                )
-                self.update_text_display(
-                    f'Sending {spokane_search_count + mead_search_count} '
-                    f'items to the NHTSA API\nThis may take a few moments...'
-                )
+            tables = self.yard_tables(location_names)
+            yard_inventory = inventory_manager.get_all(location_names)
+            if not query.is_valid() and not yard_inventory.decoded:
+                self.ui(messagebox.showinfo,
+                        'Invalid search',
+                        'Must have a "Make" input to search for Engine'
+                        )
+                return
+            if self.engine is not None:
+                self.engine.reset()
+            self.ui(self.clear_tables)
+            self.ui(self.label_tables, tables)
+            self.ui(self.clear_params)
+            if query.needs_decode() and not yard_inventory.decoded:
+                found = self.stream_search(query, yard_inventory, tables)
+            else:
+                results = yard_inventory.query(query, self.engine)
+                for tree, table_locations in tables.items():
+                    self.ui(self.fill_table,
+                            tree,
+                            self.yard_rows(results, table_locations)
+                            )
+                found = self.location_counts(results, location_names)
+
+            yard_counts = ''.join(f'\n{count} in {location_name}'
+                                  for location_name, count in found.items())
+            if query.predicates:
+                self.ui(self.update_text_display,
+                        f'Found {sum(found.values())} instances of '
+                        f'{query.describe()}{yard_counts}'
+                        )
+            else:
+                self.ui(self.update_text_display,
+                        f'{sum(found.values())} total vehicles{yard_counts}'
+                        )
 
-            spokane_results = spokane_inventory.search(
-                year=year_param,
-                make=make_param,
-                model=model_param,
-                displacement=displacement_param,
-                cylinders=cylinders_param
+    # The first yard is shown in the left table and any others together in
+    # the right one. Returns {table: [location names]}
+    def yard_tables(self, location_names):
+        tables = {self.spokane_tv: location_names[:1],
+                  self.mead_tv: location_names[1:]
+                  }
+        return {tree: names for tree, names in tables.items() if names}
+
+    def label_tables(self, tables):
+        for tree in (self.spokane_tv, self.mead_tv):
+            names = tables.get(tree)
+            tree.master.configure(
+                text=f'{", ".join(names)} Inventory' if names else 'Inventory'
             )
-            mead_results = mead_inventory.search(
-                year=year_param,
-                make=make_param,
-                model=model_param,
-                displacement=displacement_param,
-                cylinders=cylinders_param
-            )
-            self.clear_tables()
-            self.clear_params()
-            # Populate Spokane Treeview
-            self.spokane_tv['columns'] = list(spokane_results.columns)
-            self.spokane_tv['show'] = 'headings'
-            for column in self.spokane_tv['columns']:
-                self.spokane_tv.heading(column, text=column)
-                self.spokane_tv.column(column,
-                                       width=tk.font.Font().measure(column))
-                self.spokane_tv.column('Vin', width=132)
-                self.spokane_tv.column('Row', width=35)
-                self.spokane_tv.column('Year', width=36)
-
-            spokane_df_rows = spokane_results.to_numpy().tolist()
-            for row in spokane_df_rows:
-                self.spokane_tv.insert('', 'end', values=row)
-
-            # Populate Mead Treeview
-            self.mead_tv['columns'] = list(mead_results.columns)
-            self.mead_tv['show'] = 'headings'
-            for column in self.mead_tv['columns']:
-                self.mead_tv.heading(column, text=column)
-                self.mead_tv.column(column,
-                                    width=tk.font.Font().measure(column))
-                self.mead_tv.column('Vin', width=132)
-                self.mead_tv.column('Row', width=35)
-                self.mead_tv.column('Year', width=36)
-
-            mead_df_rows = mead_results.to_numpy().tolist()
-            for row in mead_df_rows:
-                self.mead_tv.insert('', 'end', values=row)
-
-            spokane_count = spokane_results.shape[0]
-            mead_count = mead_results.shape[0]
 
-            if year_param and make_param and model_param and displacement_param and cylinders_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{year_param} {make_param} {model_param} '
-                    f'{displacement_param}L {cylinders_param}cyl'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            if year_param and make_param and model_param and displacement_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{year_param} {make_param} {model_param} '
-                    f'{displacement_param}L'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif year_param and make_param and model_param and cylinders_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{year_param} {make_param} {model_param} '
-                    f'{cylinders_param}cyl'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif make_param and model_param and displacement_param and cylinders_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{make_param} {model_param} {displacement_param}L '
-                    f'{cylinders_param}cyl'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif make_param and model_param and displacement_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{make_param} {model_param} {displacement_param}L '
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif make_param and model_param and cylinders_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{make_param} {model_param} {cylinders_param}cyl'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif make_param and displacement_param and cylinders_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{make_param} {displacement_param}L {cylinders_param}cyl'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif make_param and displacement_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{make_param} {displacement_param}L'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif make_param and cylinders_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{make_param} {cylinders_param}cyl'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif year_param and make_param and model_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{year_param} {make_param} {model_param}'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif year_param and make_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{year_param} {make_param}'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif year_param and model_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{year_param} {model_param}'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif make_param and model_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{make_param} {model_param}'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif year_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{year_param}'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif make_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{make_param}'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            elif model_param:
-                self.update_text_display(
-                    f'Found {spokane_count + mead_count} instances of '
-                    f'{model_param}'
-                    f'\n{spokane_count} in Spokane'
-                    f'\n{mead_count} in Mead'
-                )
-            else:
-                self.update_text_display(
-                    f'{spokane_count + mead_count} total vehicles'
+    # A table's rows, tables showing more than one yard keep the Location
+    # column
+    @staticmethod
+    def yard_rows(results, location_names):
+        if len(location_names) == 1:
+            return location_rows(results, location_names[0])
+        return results[results['Location'].isin(location_names)]
+
+    @staticmethod
+    def location_counts(results, location_names):
+        counts = results['Location'].value_counts()
+        return {location_name: int(counts.get(location_name, 0))
+                for location_name in location_names}
+
+    # Sets up the table columns for the results, then streams the rows in
+    # TABLE_CHUNK_SIZE at a time
+    def fill_table(self, tree, results):
+        self.cancel_fill(tree)
+        tree['columns'] = list(results.columns)
+        tree['show'] = 'headings'
+        for column in tree['columns']:
+            tree.heading(column, text=column)
+            tree.column(column, width=tk.font.Font().measure(column))
+        tree.column('Vin', width=132)
+        tree.column('Row', width=35)
+        tree.column('Year', width=36)
+        self.append_rows(tree, results)
+
+    # Adds rows to the end of a table that fill_table set up
+    def append_rows(self, tree, results):
+        # Blank cells for engines that aren't decoded instead of nan
+        rows = results.astype(object).where(results.notna(), '')
+        self.table_rows.setdefault(tree, []).extend(rows.to_numpy().tolist())
+        if tree not in self.table_jobs:
+            self.insert_rows(tree)
+
+    def insert_rows(self, tree):
+        rows = self.table_rows[tree]
+        for row in rows[:TABLE_CHUNK_SIZE]:
+            tree.insert('', 'end', values=row)
+        del rows[:TABLE_CHUNK_SIZE]
+        if rows:
+            self.table_jobs[tree] = self.after(TABLE_CHUNK_DELAY,
+                                               self.insert_rows,
+                                               tree
+                                               )
+        else:
+            self.table_jobs.pop(tree, None)
+
+    # Stops a table from getting the rest of an older search's rows
+    def cancel_fill(self, tree):
+        self.table_rows[tree] = []
+        job = self.table_jobs.pop(tree, None)
+        if job is not None:
+            self.after_cancel(job)
+
+    # Engine search that adds vehicles to the tables as their VINs are
+    # decoded, with a progress and time left line. Returns the number of
+    # vehicles found per yard.
+    def stream_search(self, query, yard_inventory, tables):
+        api_count = yard_inventory.decode_count(query)
+        self.ui(self.update_text_display,
+                f'Sending {api_count} items to the NHTSA API\n'
                 )
+        start_time = time.monotonic()
+        location_names = [location_name for names in tables.values()
+                          for location_name in names]
+        found = dict.fromkeys(location_names, 0)
+        parts = yard_inventory.query_stream(query, self.engine)
+        for part, (matches, decoded, _) in enumerate(parts):
+            for tree, table_locations in tables.items():
+                yard_matches = self.yard_rows(matches, table_locations)
+                if part == 0:
+                    # The first part sets up the columns, it may be empty
+                    self.ui(self.fill_table, tree, yard_matches)
+                else:
+                    self.ui(self.append_rows, tree, yard_matches)
+            for location_name, count in self.location_counts(
+                    matches, location_names).items():
+                found[location_name] += count
+            self.ui(self.scrape_update,
+                    self.decode_progress(decoded,
+                                         api_count,
+                                         sum(found.values()),
+                                         start_time
+                                         ))
+        return found
+
+    @staticmethod
+    def decode_progress(decoded, total, found, start_time):
+        progress = f'Decoded {decoded}/{total} VINs, {found} found'
+        if 0 < decoded < total:
+            elapsed = time.monotonic() - start_time
+            time_left = elapsed / decoded * (total - decoded)
+            progress += f', about {time_left:.0f}s left'
+        return progress
 
     def clear_tables(self):
-        self.spokane_tv.delete(*self.spokane_tv.get_children())
-        self.mead_tv.delete(*self.mead_tv.get_children())
+        for tree in (self.spokane_tv, self.mead_tv):
+            self.cancel_fill(tree)
+            tree.delete(*tree.get_children())
 
     def clear_params(self):
         self.year_entry.delete(0, tk.END)
@@ -775,418 +679,53 @@ class App(ctk.CTk):
         self.text_display.insert(tk.END, content)
         self.text_display.configure(state=tk.DISABLED)
 
+    # Runs func(*args) on the main loop. Worker threads use this for every
+    # widget update instead of calling the widget methods themselves.
+    def ui(self, func, *args):
+        self.ui_queue.put((func, args))
+
+    # Runs the widget updates queued since the last run. An update that
+    # raises is reported the way Tk reports callback errors, so the rest
+    # still run and the queue keeps being polled.
+    def process_ui_queue(self):
+        for _ in range(self.ui_queue.qsize()):
+            func, args = self.ui_queue.get_nowait()
+            try:
+                func(*args)
+            except Exception:
+                self.report_callback_exception(*sys.exc_info())
+        self.after(UI_POLL_INTERVAL, self.process_ui_queue)
+
+    # Draws the newest scrape progress, once no matter how many pages
+    # finished since it was queued
+    def draw_progress(self):
+        with self.progress_lock:
+            progress_line, self.progress_line = self.progress_line, None
+        if progress_line is not None:
+            self.scrape_update(progress_line)
+
+    # Shows a scraper message in the text display and the console
+    def report(self, content):
+        self.ui(self.write_to_text_display, content)
+        print(content)
+
     def how_to_use_fuc(self):
         self.update_text_display(self.how_to_use)
 
+    def report_progress(self, location_name, pages_done, page_count):
+        with self.progress_lock:
+            self.scrape_progress[location_name] = (pages_done, page_count)
+            progress = ' | '.join(
+                f'{location}: {done}/{count}'
+                for location, (done, count) in self.scrape_progress.items()
+            )
+            if self.progress_line is None:
+                self.ui(self.draw_progress)
+            self.progress_line = f'Scraped pages - {progress}'
+
+    # Replaces the last line of the text display with a progress update
     def scrape_update(self, content):
         self.text_display.configure(state=tk.NORMAL)
-        if count_lines(self.text_display) < 4:
-            self.text_display.delete(3.0, tk.END)
-        else:
-            self.text_display.delete(10.0, tk.END)
+        self.text_display.delete('end-1c linestart', tk.END)
         self.text_display.insert(tk.END, content)
-
-
-class Inventory:
-    def __init__(self, file):
-        self.file = file
-        self.location = file.split('-')[0]
-        file_path = os.path.join('data_cache', f'{self.file}')
-
-        self.inventory = pd.read_csv(file_path)
-
-    def search(self,
-               year=None,
-               make=None,
-               model=None,
-               displacement=None,
-               cylinders=None
-               ):
-        if make:
-            if make.upper() == 'CHEVY':
-                make = 'CHEVROLET'
-            elif make.upper() == 'NISSAN' or make.upper() == 'DATSUN':
-                make = 'DATSUN - NISSAN'
-            else:
-                make = str(make.upper())
-        if model:
-            model = str(model.upper())
-        if displacement:
-            displacement = float(displacement)
-        if year:
-            year = int(year)
-        if cylinders:
-            cylinders = str(cylinders)
-
-        if displacement and not make:
-            return 'Invalid search parameters'
-        if cylinders and not make:
-            return 'Invalid search parameters'
-
-        if year and make and model and displacement and cylinders:
-            results = self.inventory[
-                (self.inventory['Year'] == year) &
-                (self.inventory['Make'] == make) &
-                (self.inventory['Model'] == model)
-                ]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[(df_copy['Liters'] == displacement) &
-                                 (df_copy['Cylinders'] == cylinders)
-                                 ]
-
-            return out_put_df
-
-        elif make and model and displacement and cylinders:
-            results = self.inventory[
-                (self.inventory['Make'] == make) &
-                (self.inventory['Model'] == model)
-                ]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[(df_copy['Liters'] == displacement) &
-                                 (df_copy['Cylinders'] == cylinders)
-                                 ]
-
-            return out_put_df
-
-        elif make and displacement and cylinders:
-            results = self.inventory[self.inventory['Make'] == make]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[(df_copy['Liters'] == displacement) &
-                                 (df_copy['Cylinders'] == cylinders)
-                                 ]
-
-            return out_put_df
-
-        elif year and make and model and cylinders:
-            results = self.inventory[
-                (self.inventory['Year'] == year) &
-                (self.inventory['Make'] == make) &
-                (self.inventory['Model'] == model)
-                ]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[df_copy['Cylinders'] == cylinders]
-
-            return out_put_df
-
-        elif year and make and model and displacement:
-            results = self.inventory[
-                (self.inventory['Year'] == year) &
-                (self.inventory['Make'] == make) &
-                (self.inventory['Model'] == model)
-                ]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[df_copy['Liters'] == displacement]
-
-            return out_put_df
-
-        elif make and model and cylinders:
-            results = self.inventory[
-                (self.inventory['Make'] == make) &
-                (self.inventory['Model'] == model)
-                ]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[df_copy['Cylinders'] == cylinders]
-
-            return out_put_df
-
-        elif make and model and displacement:
-            results = self.inventory[
-                (self.inventory['Make'] == make) &
-                (self.inventory['Model'] == model)
-                ]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[df_copy['Liters'] == displacement]
-
-            return out_put_df
-
-        elif make and cylinders:
-            results = self.inventory[self.inventory['Make'] == make]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[df_copy['Cylinders'] == cylinders]
-
-            return out_put_df
-
-        elif make and displacement:
-            results = self.inventory[self.inventory['Make'] == make]
-
-            df_copy = results.copy()
-
-            api_message = (f'Sending {df_copy.shape[0]} '
-                           f'items to NHTSA API.'
-                           f'\nThis may take a few moments...')
-            print(api_message)
-
-            for index, row in df_copy.iterrows():
-                vin = row['Vin']
-                decode_data = vin_decode(vin)
-                if decode_data:
-                    df_copy.at[index, 'Liters'] = get_displacement(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Cylinders'] = get_cylinder_count(
-                        decode_data
-                    )
-                    df_copy.at[index, 'Engine Model'] = get_engine_model(
-                        decode_data
-                    )
-
-            out_put_df = df_copy[df_copy['Liters'] == displacement]
-
-            return out_put_df
-
-        elif year and make and model:
-            results = self.inventory[
-                (self.inventory['Year'] == year) &
-                (self.inventory['Make'] == make) &
-                (self.inventory['Model'] == model)
-                ]
-            return results
-
-        elif year and make:
-            results = self.inventory[
-                (self.inventory['Year'] == year) &
-                (self.inventory['Make'] == make)
-                ]
-            return results
-
-        elif year and model:
-            results = self.inventory[
-                (self.inventory['Year'] == year) &
-                (self.inventory['Model'] == model)
-                ]
-            return results
-
-        elif make and model:
-            results = self.inventory[
-                (self.inventory['Make'] == make) &
-                (self.inventory['Model'] == model)
-                ]
-            return results
-
-        elif year:
-            results = self.inventory[self.inventory['Year'] == year]
-            return results
-
-        elif make:
-            results = self.inventory[self.inventory['Make'] == make]
-            return results
-
-        elif model:
-            results = self.inventory[self.inventory['Model'] == model]
-            return results
-
-        else:
-            return self.inventory
-
-    def api_search_count(self, year=None, make=None, model=None):
-        if make:
-            if make.upper() == 'CHEVY':
-                make = 'CHEVROLET'
-            elif make.upper() == 'NISSAN' or make.upper() == 'DATSUN':
-                make = 'DATSUN - NISSAN'
-            else:
-                make = make.upper()
-        if model:
-            model = model.upper()
-        if year:
-            year = int(year)
-
-        if year and make and model:
-            results = self.inventory[(self.inventory['Year'] == year) &
-                                     (self.inventory['Make'] == make) &
-                                     (self.inventory['Model'] == model)
-                                     ]
-            return results.shape[0]
-
-        elif year and make:
-            results = self.inventory[(self.inventory['Year'] == year) &
-                                     (self.inventory['Make'] == make)
-                                     ]
-            return results.shape[0]
-        elif year and model:
-            results = self.inventory[(self.inventory['Year'] == year) &
-                                     (self.inventory['Model'] == model)
-                                     ]
-            return results.shape[0]
-        elif make and model:
-            results = self.inventory[(self.inventory['Make'] == make) &
-                                     (self.inventory['Model'] == model)
-                                     ]
-            return results.shape[0]
-        elif year:
-            results = self.inventory[self.inventory['Year'] == year]
-            return results.shape[0]
-        elif make:
-            results = self.inventory[self.inventory['Make'] == make]
-            return results.shape[0]
-        elif model:
-            results = self.inventory[self.inventory['Model'] == model]
-            return results.shape[0]
+        self.text_display.configure(state=tk.DISABLED)
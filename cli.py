@@ -0,0 +1,299 @@
+import argparse
+import sys
+
+# Headless entry point for scripts and cron jobs, no display needed.
+#   python -m cli scrape [--incremental] [--async | --processes 4]
+#                        [--predecode] [--yard Spokane]
+#   python -m cli search --make subaru --liters 2.5
+#   python -m cli decode JF1BE6LC94G000000
+#   python -m cli history --since 2024-05-01
+#   python -m cli watch add "EJ25 Legacy" --make subaru --liters 2.5
+#   python -m cli patterns
+# Modules are imported inside each command so only what's used gets loaded.
+
+
+def async_engine(args):
+    if not args.use_async:
+        return None
+    from async_engine import AsyncEngine
+    return AsyncEngine()
+
+
+# The given yards, or every yard in the registry. Exits with the error if
+# the registry can't be read or a given yard isn't in it.
+def registry_yards(location_names=None):
+    from scraper import YARDS_FILE, get_yards
+    try:
+        yards = get_yards()
+    except ValueError as error:
+        sys.exit(str(error))
+    unknown = [location_name for location_name in location_names or ()
+               if location_name not in yards]
+    if unknown:
+        sys.exit(f'Unknown yard {", ".join(unknown)}, the yards in '
+                 f'{YARDS_FILE} are {", ".join(yards)}')
+    return list(location_names or yards)
+
+
+def scrape(args):
+    import threading
+    from scraper import make_file, predecode_inventory, refresh_yards
+
+    location_names = registry_yards(args.yard)
+    if args.processes:
+        refresh_yards(location_names,
+                      args.processes,
+                      args.incremental,
+                      args.predecode,
+                      args.workers
+                      )
+        return
+
+    engine = async_engine(args)
+    yard_threads = [
+        threading.Thread(target=make_file,
+                         args=(location_name,),
+                         kwargs={'max_workers': args.workers,
+                                 'incremental': args.incremental,
+                                 'engine': engine
+                                 }
+                         )
+        for location_name in location_names
+    ]
+    for yard_thread in yard_threads:
+        yard_thread.start()
+    for yard_thread in yard_threads:
+        yard_thread.join()
+
+    # Decode here instead of in the background, the process is about to end
+    if args.predecode:
+        for location_name in location_names:
+            predecode_inventory(location_name, engine)
+
+
+def search(args):
+    import pandas as pd
+    from inventory import Query, inventory_manager, location_rows
+
+    query = Query(year=args.year,
+                  make=args.make,
+                  model=args.model,
+                  displacement=args.liters,
+                  cylinders=args.cylinders
+                  )
+    # Yards in the registry that haven't been scraped yet are skipped
+    location_names = [
+        location_name for location_name in registry_yards(args.yard)
+        if inventory_manager.store_mtime(f'{location_name}_inventory.csv')
+    ]
+    unscraped = [location_name for location_name in args.yard or ()
+                 if location_name not in location_names]
+    if unscraped:
+        print(f'Data not yet scraped for {", ".join(unscraped)}!\n'
+              f'Please update the inventory before continuing.')
+        return 1
+    if not location_names:
+        print('Data not yet scraped!\n'
+              'Please update the inventory before continuing.')
+        return 1
+    yard_inventory = inventory_manager.get_all(location_names)
+    if not query.is_valid() and not yard_inventory.decoded:
+        print('Must have a "Make" input to search for Engine')
+        return 1
+
+    engine = async_engine(args)
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', None)
+    results = yard_inventory.query(query, engine)
+    for location_name in location_names:
+        yard_results = location_rows(results, location_name)
+        print(f'{location_name}: {yard_results.shape[0]} found')
+        if not yard_results.empty:
+            print(yard_results.to_string(index=False))
+
+
+def decode(args):
+    from decoder import decode_engine_batch
+
+    # Every VIN asked for by name gets its own full decode
+    engines = decode_engine_batch(args.vins, share=False)
+    for vin in args.vins:
+        engine = engines.get(vin)
+        if engine is None:
+            print(f'{vin}: decode failed')
+        else:
+            print(f'{vin}: {engine.liters}L, '
+                  f'{engine.cylinders} cylinders, '
+                  f'engine model {engine.engine_model}, '
+                  f'{engine.fuel_type}, {engine.transmission}, '
+                  f'{engine.drive_type}, trim {engine.trim}')
+
+
+def history(args):
+    import pandas as pd
+    from history import arrivals_since, inventory_on
+
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', None)
+    for location_name in registry_yards(args.yard):
+        if args.since:
+            vehicles = arrivals_since(location_name, args.since)
+            print(f'{location_name}: {vehicles.shape[0]} arrived since '
+                  f'{args.since} and still in the yard')
+        else:
+            vehicles = inventory_on(location_name, args.on)
+            print(f'{location_name}: {vehicles.shape[0]} vehicles on '
+                  f'{args.on}')
+        if not vehicles.empty:
+            print(vehicles.to_string(index=False))
+
+
+def watch(args):
+    from watchlist import load_watches, remove_watch, save_watch
+
+    if args.action == 'add':
+        try:
+            save_watch(args.name,
+                       year=args.year,
+                       make=args.make,
+                       model=args.model,
+                       displacement=args.liters,
+                       cylinders=args.cylinders,
+                       location=args.yard
+                       )
+        except ValueError as error:
+            print(error)
+            return 1
+        print(f'Saved watch "{args.name}"')
+    elif args.action == 'remove':
+        if not remove_watch(args.name):
+            print(f'No watch named "{args.name}"')
+            return 1
+        print(f'Removed watch "{args.name}"')
+    else:
+        for name, filters in load_watches().items():
+            filter_text = ', '.join(f'{column}={value}'
+                                    for column, value in filters.items())
+            print(f'{name}: {filter_text}')
+
+
+def patterns(args):
+    from decoder import export_patterns
+
+    pattern_count = export_patterns(args.output)
+    print(f'{pattern_count} VIN patterns written')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cli',
+                                     description='P&S Inventory Search'
+                                     )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scrape_parser = commands.add_parser('scrape',
+                                        help='update the yard inventories'
+                                        )
+    scrape_parser.add_argument('--yard', action='append',
+                               help='only update this yard (repeatable)'
+                               )
+    scrape_parser.add_argument('--incremental', action='store_true',
+                               help='stop at the first already known page'
+                               )
+    scrape_parser.add_argument('--workers', type=int,
+                               help='pages fetched at the same time per yard'
+                               )
+    scrape_mode = scrape_parser.add_mutually_exclusive_group()
+    scrape_mode.add_argument('--async', dest='use_async',
+                             action='store_true',
+                             help='fetch every page at once with asyncio '
+                                  '(needs aiohttp)'
+                             )
+    scrape_mode.add_argument('--processes', type=int,
+                             help='scrape this many yards at the same time, '
+                                  'each in its own process'
+                             )
+    scrape_parser.add_argument('--predecode', action='store_true',
+                               help='decode the engine of every new VIN '
+                                    'after updating'
+                               )
+    scrape_parser.set_defaults(func=scrape)
+
+    search_parser = commands.add_parser('search',
+                                        help='search the yard inventories'
+                                        )
+    search_parser.add_argument('--year', help='year or range, e.g. 2000-2005')
+    search_parser.add_argument('--make')
+    search_parser.add_argument('--model')
+    search_parser.add_argument('--liters', help='displacement or range')
+    search_parser.add_argument('--cylinders', help='cylinders or range')
+    search_parser.add_argument('--yard', action='append',
+                               help='only search this yard (repeatable)'
+                               )
+    search_parser.add_argument('--async', dest='use_async',
+                               action='store_true',
+                               help='decode every VIN batch at once with '
+                                    'asyncio (needs aiohttp)'
+                               )
+    search_parser.set_defaults(func=search)
+
+    decode_parser = commands.add_parser('decode',
+                                        help='decode the engine of VINs'
+                                        )
+    decode_parser.add_argument('vins', nargs='+', metavar='VIN')
+    decode_parser.set_defaults(func=decode)
+
+    history_parser = commands.add_parser(
+        'history',
+        help='past yard inventories and new arrivals'
+    )
+    history_when = history_parser.add_mutually_exclusive_group(required=True)
+    history_when.add_argument('--on', metavar='DATE',
+                              help='vehicles in the yard on this date'
+                              )
+    history_when.add_argument('--since', metavar='DATE',
+                              help='vehicles that arrived since this date '
+                                   'and are still in the yard'
+                              )
+    history_parser.add_argument('--yard', action='append',
+                                help='only this yard (repeatable)'
+                                )
+    history_parser.set_defaults(func=history)
+
+    watch_parser = commands.add_parser(
+        'watch',
+        help='saved searches checked against new arrivals after each update'
+    )
+    watch_actions = watch_parser.add_subparsers(dest='action', required=True)
+    watch_add_parser = watch_actions.add_parser('add', help='save a search')
+    watch_add_parser.add_argument('name')
+    watch_add_parser.add_argument('--year',
+                                  help='year or range, e.g. 2000-2005'
+                                  )
+    watch_add_parser.add_argument('--make')
+    watch_add_parser.add_argument('--model')
+    watch_add_parser.add_argument('--liters', help='displacement or range')
+    watch_add_parser.add_argument('--cylinders', help='cylinders or range')
+    watch_add_parser.add_argument('--yard', help='only watch this yard')
+    watch_remove_parser = watch_actions.add_parser('remove',
+                                                   help='delete a watch'
+                                                   )
+    watch_remove_parser.add_argument('name')
+    watch_actions.add_parser('list', help='show the saved watches')
+    watch_parser.set_defaults(func=watch)
+
+    patterns_parser = commands.add_parser(
+        'patterns',
+        help='build the offline VIN pattern table from the VIN cache'
+    )
+    patterns_parser.add_argument('--output',
+                                 help='file to write, defaults to '
+                                      'data_cache/vpic_patterns.csv'
+                                 )
+    patterns_parser.set_defaults(func=patterns)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
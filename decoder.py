@@ -0,0 +1,474 @@
+import csv
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import CancelledError
+from network import http_session
+
+
+# NHTSA API location, can be pointed at a local stand-in server for testing
+NHTSA_API_URL = os.environ.get('NHTSA_API_URL',
+                               'https://vpic.nhtsa.dot.gov/api/vehicles'
+                               )
+# Max VINs the DecodeVINValuesBatch endpoint accepts per request
+VIN_BATCH_SIZE = 50
+
+
+# VIN decode function (NHTSA API)
+def vin_decode(vin):
+    url = f'{NHTSA_API_URL}/decodevin/{vin}?format=json'
+    response = http_session.get(url)
+    if response.status_code == 200:
+        data = response.json()
+        if 'Results' in data:
+            results = data['Results']
+            return results
+        else:
+            return 'VIN decoding failed'
+    else:
+        return (
+            f'Error: Failed to fetch data from NHTSA API'
+            f'\nError code: {response.status_code}'
+        )
+
+
+# Batch VIN decode function (NHTSA API), takes up to VIN_BATCH_SIZE VINs
+def vin_decode_batch(vins):
+    response = http_session.post(batch_url(), data=batch_form(vins))
+    data = None
+    if response.status_code == 200:
+        data = response.json()
+    return batch_results(response.status_code, data)
+
+
+def batch_url():
+    return f'{NHTSA_API_URL}/DecodeVINValuesBatch/'
+
+
+def batch_form(vins):
+    return {'format': 'json', 'data': ';'.join(vins)}
+
+
+# Gets the results list out of a batch decode response
+def batch_results(status_code, data):
+    if status_code == 200:
+        if 'Results' in data:
+            results = data['Results']
+            return results
+        else:
+            return 'VIN decoding failed'
+    else:
+        return (
+            f'Error: Failed to fetch data from NHTSA API'
+            f'\nError code: {status_code}'
+        )
+
+
+# Decoded vehicle data kept per VIN. Slots instead of a dict per record,
+# and only the fields used out of the ~140 the API returns.
+class DecodeResult:
+    # Inventory column -> (attribute, batch result key, decodevin Variable)
+    FIELDS = {'Liters': ('liters', 'DisplacementL', 'Displacement (L)'),
+              'Cylinders': ('cylinders', 'EngineCylinders',
+                            'Engine Number of Cylinders'),
+              'Engine Model': ('engine_model', 'EngineModel',
+                               'Engine Model'),
+              'Fuel Type': ('fuel_type', 'FuelTypePrimary',
+                            'Fuel Type - Primary'),
+              'Transmission': ('transmission', 'TransmissionStyle',
+                               'Transmission Style'),
+              'Drive Type': ('drive_type', 'DriveType', 'Drive Type'),
+              'Trim': ('trim', 'Trim', 'Trim')
+              }
+    __slots__ = tuple(attribute for attribute, _, _ in FIELDS.values())
+
+    def __init__(self,
+                 liters=0.0,
+                 cylinders=None,
+                 engine_model=None,
+                 fuel_type=None,
+                 transmission=None,
+                 drive_type=None,
+                 trim=None
+                 ):
+        self.liters = round(float(liters or 0.0), 1)
+        self.cylinders = cylinders or None
+        self.engine_model = engine_model or None
+        self.fuel_type = fuel_type or None
+        self.transmission = transmission or None
+        self.drive_type = drive_type or None
+        self.trim = trim or None
+
+    # From a flat DecodeVINValuesBatch result
+    @classmethod
+    def from_batch(cls, result):
+        return cls(**{attribute: result.get(key)
+                      for attribute, key, _ in cls.FIELDS.values()})
+
+    # From a decodevin results list, indexed by Variable in one pass
+    @classmethod
+    def from_results(cls, results):
+        values = {result['Variable']: result.get('Value')
+                  for result in results if 'Variable' in result}
+        return cls(**{attribute: values.get(variable)
+                      for attribute, _, variable in cls.FIELDS.values()})
+
+    # Lets records be read by inventory column, e.g. result['Liters']
+    def __getitem__(self, column):
+        return getattr(self, self.FIELDS[column][0])
+
+    def engine(self):
+        return self.liters, self.cylinders, self.engine_model
+
+    # Copy for another VIN with the same engine key. Transmission, drive
+    # type and trim aren't pinned down by the key, so they're left empty.
+    def engine_copy(self):
+        return DecodeResult(liters=self.liters,
+                            cylinders=self.cylinders,
+                            engine_model=self.engine_model,
+                            fuel_type=self.fuel_type
+                            )
+
+    def values(self):
+        return tuple(getattr(self, attribute) for attribute in self.__slots__)
+
+    def __eq__(self, other):
+        return (isinstance(other, DecodeResult)
+                and self.values() == other.values())
+
+    def __repr__(self):
+        return f'DecodeResult{self.values()}'
+
+
+# Persistent cache of decoded engine data, keyed by VIN. A VIN always decodes
+# to the same engine, so entries never expire.
+class VinCache:
+    # Cache table columns, in DecodeResult slot order
+    COLUMNS = ('liters REAL', 'cylinders TEXT', 'engine_model TEXT',
+               'fuel_type TEXT', 'transmission TEXT', 'drive_type TEXT',
+               'trim TEXT')
+
+    def __init__(self, file='vin_cache.db'):
+        self.file_path = os.path.join('data_cache', file)
+        self.connection = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.names = ', '.join(column.split()[0] for column in self.COLUMNS)
+
+    def connect(self):
+        if self.connection is None:
+            if not os.path.exists('data_cache'):
+                os.makedirs('data_cache')
+            self.connection = sqlite3.connect(self.file_path,
+                                              check_same_thread=False
+                                              )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS engines ('
+                f'vin TEXT PRIMARY KEY, {", ".join(self.COLUMNS)})'
+            )
+            # Caches made before a column was added get it, empty
+            existing = {row[1] for row in self.connection.execute(
+                'PRAGMA table_info(engines)'
+            )}
+            for column in self.COLUMNS:
+                if column.split()[0] not in existing:
+                    self.connection.execute(
+                        f'ALTER TABLE engines ADD COLUMN {column}'
+                    )
+            self.connection.commit()
+        return self.connection
+
+    @staticmethod
+    def result(row):
+        result = DecodeResult()
+        for attribute, value in zip(DecodeResult.__slots__, row):
+            setattr(result, attribute, value)
+        return result
+
+    def get_many(self, vins):
+        engines = {}
+        with self.lock:
+            connection = self.connect()
+            # Stay under SQLite's limit on query parameters
+            for start in range(0, len(vins), 500):
+                chunk = vins[start:start + 500]
+                rows = connection.execute(
+                    f'SELECT vin, {self.names} FROM engines WHERE vin IN '
+                    f'({", ".join("?" * len(chunk))})',
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    engines[row[0]] = self.result(row[1:])
+            self.hits += len(engines)
+            self.misses += len(vins) - len(engines)
+        return engines
+
+    def set_many(self, engines):
+        with self.lock:
+            connection = self.connect()
+            connection.executemany(
+                f'INSERT OR REPLACE INTO engines (vin, {self.names}) '
+                f'VALUES (?, {", ".join("?" * len(self.COLUMNS))})',
+                [(vin, *engine.values()) for vin, engine in engines.items()]
+            )
+            connection.commit()
+
+    def all_engines(self):
+        with self.lock:
+            rows = self.connect().execute(
+                f'SELECT vin, {self.names} FROM engines'
+            ).fetchall()
+        return {row[0]: self.result(row[1:]) for row in rows}
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+
+vin_cache = VinCache()
+
+
+# The WMI + VDS (characters 1-8) and model year (character 10) of a VIN.
+# For most makes these pin down the engine.
+def vin_pattern_key(vin):
+    vin = str(vin).upper()
+    return vin[:8] + vin[9:10]
+
+
+# Makes whose engine isn't pinned down by vin_pattern_key, mapped to the
+# VIN positions (0 based) that do, or None to decode each of their VINs on
+# its own. For example 'FORD': (0, 1, 2, 3, 4, 5, 6, 7, 9, 10) would also
+# split Ford VINs by assembly plant.
+ENGINE_KEY_MAKES = {}
+
+
+# Key that VINs with the same engine share, None if the VIN can't be
+# grouped with others (pre-1981 VINs or makes set to None)
+def engine_key(vin, make=None):
+    vin = str(vin).upper()
+    if len(vin) != 17:
+        return None
+    if make not in ENGINE_KEY_MAKES:
+        return vin_pattern_key(vin)
+    positions = ENGINE_KEY_MAKES[make]
+    if positions is None:
+        return None
+    return ''.join(vin[position] for position in positions)
+
+
+# Groups VINs by engine key so only the first VIN of each group has to be
+# decoded. makes is an optional {vin: make} dict for ENGINE_KEY_MAKES.
+# With share=False every VIN is decoded on its own.
+# Returns a list of VIN lists.
+def plan_decode(vins, makes=None, share=True):
+    if not share:
+        return [[vin] for vin in vins]
+    groups = {}
+    singles = []
+    for vin in vins:
+        key = engine_key(vin, makes.get(vin) if makes else None)
+        if key is None:
+            singles.append([vin])
+        else:
+            groups.setdefault(key, []).append(vin)
+    return list(groups.values()) + singles
+
+
+# Decodes engines locally from a pattern table derived from NHTSA's vPIC
+# database, stored as data_cache/vpic_patterns.csv with the columns
+# Pattern, Liters, Cylinders, Engine Model. Patterns are 9 characters in
+# vin_pattern_key order and may use '*' to match any character.
+class OfflineDecoder:
+    def __init__(self, file='vpic_patterns.csv'):
+        self.file_path = os.path.join('data_cache', file)
+        self.exact = None
+        self.wildcards = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        with self.lock:
+            if self.exact is not None:
+                return
+            exact = {}
+            wildcards = {}
+            if os.path.exists(self.file_path):
+                with open(self.file_path, newline='') as file:
+                    for row in csv.DictReader(file):
+                        pattern = row['Pattern'].upper()
+                        engine = DecodeResult(
+                            liters=row['Liters'],
+                            cylinders=row['Cylinders'],
+                            engine_model=row['Engine Model']
+                        )
+                        if '*' in pattern:
+                            # Grouped by WMI so a lookup only checks the
+                            # patterns of one manufacturer
+                            wildcards.setdefault(pattern[:3], []).append(
+                                (pattern, engine)
+                            )
+                        else:
+                            exact[pattern] = engine
+            self.exact = exact
+            self.wildcards = wildcards
+
+    # Makes in ENGINE_KEY_MAKES aren't pinned down by the 9 character
+    # patterns, so they are never decoded offline
+    def decode(self, vin, make=None):
+        if make in ENGINE_KEY_MAKES:
+            self.misses += 1
+            return None
+        self.load()
+        key = vin_pattern_key(vin)
+        engine = self.exact.get(key)
+        if engine is None:
+            for pattern, pattern_engine in self.wildcards.get(key[:3], ()):
+                if all(wanted in ('*', char)
+                       for wanted, char in zip(pattern, key)):
+                    engine = pattern_engine
+                    break
+        if engine is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return engine
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+
+offline_decoder = OfflineDecoder()
+
+
+# Writes a pattern table for OfflineDecoder from the VIN cache. Only
+# patterns whose cached VINs all decoded to the same engine are kept.
+def export_patterns(file_path=None):
+    file_path = file_path or offline_decoder.file_path
+    patterns = {}
+    conflicts = set()
+    for vin, engine in vin_cache.all_engines().items():
+        key = vin_pattern_key(vin)
+        if len(key) < 9:
+            continue
+        if patterns.setdefault(key, engine).engine() != engine.engine():
+            conflicts.add(key)
+
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Pattern', 'Liters', 'Cylinders', 'Engine Model'])
+        for key, engine in sorted(patterns.items()):
+            if key not in conflicts:
+                writer.writerow([key,
+                                 engine.liters,
+                                 engine.cylinders or '',
+                                 engine.engine_model or ''
+                                 ])
+    return len(patterns) - len(conflicts)
+
+
+# Caches the engines from one batch decode. Returns a {vin: DecodeResult}
+# dict.
+def store_batch(batch, decode_data):
+    if not isinstance(decode_data, list):
+        print(decode_data)
+        return {}
+    decoded = {}
+    for result in decode_data:
+        vin = result.get('VIN')
+        if vin in batch:
+            decoded[vin] = DecodeResult.from_batch(result)
+    vin_cache.set_many(decoded)
+    return decoded
+
+
+# Decodes the engines of many VINs from the cache, then the offline pattern
+# table, sending the rest to the NHTSA batch endpoint. Yields
+# (vins, {vin: DecodeResult}) as each part finishes: first everything that
+# was cached or decoded offline, then each API batch. VINs that failed to
+# decode are in vins but not in the dict. With an AsyncEngine all batches
+# are sent at once and are yielded in the order they finish.
+# Only one VIN per engine key is sent to the API (see plan_decode), the
+# others get a copy of its engine. Copies are only kept in memory (and in
+# the inventory's engine columns), the cache only holds real decodes.
+# share=False turns off both the copies and the offline pattern table, so
+# every VIN gets its own full decode (trim, transmission, drive type).
+def decode_engine_stream(vins, engine=None, makes=None, share=True):
+    vins = list(dict.fromkeys(vins))
+    engines = vin_cache.get_many(vins)
+    for vin in vins:
+        if share and vin not in engines:
+            offline_engine = offline_decoder.decode(
+                vin, makes.get(vin) if makes else None
+            )
+            if offline_engine is not None:
+                engines[vin] = offline_engine
+    # VINs sharing an engine key with a cached VIN get a copy of its engine
+    known = {}
+    if share:
+        for vin, engine_result in engines.items():
+            key = engine_key(vin, makes.get(vin) if makes else None)
+            if key is not None:
+                known.setdefault(key, engine_result)
+    for vin in vins:
+        if vin not in engines:
+            key = engine_key(vin, makes.get(vin) if makes else None)
+            if key in known:
+                engines[vin] = known[key].engine_copy()
+    if engines:
+        yield list(engines), engines
+    misses = [vin for vin in vins if vin not in engines]
+    groups = {group[0]: group
+              for group in plan_decode(misses, makes, share)}
+    representatives = list(groups)
+    batches = [representatives[start:start + VIN_BATCH_SIZE]
+               for start in range(0, len(representatives), VIN_BATCH_SIZE)]
+
+    # Copies each decoded engine to the rest of its group
+    def share_group(batch, decoded):
+        shared = {vin: engine_result.engine_copy()
+                  for representative, engine_result in decoded.items()
+                  for vin in groups[representative][1:]}
+        decoded.update(shared)
+        return [vin for representative in batch
+                for vin in groups[representative]], decoded
+
+    if engine is not None and batches:
+        finished = queue.Queue()
+
+        def batch_done(batch, decode_data):
+            finished.put(share_group(batch,
+                                     store_batch(batch, decode_data)))
+
+        def decode_batches():
+            try:
+                engine.run(engine.decode_batches(batches, batch_done))
+            except CancelledError:
+                print('VIN decoding cancelled')
+            except Exception as error:
+                finished.put(error)
+            finally:
+                finished.put(None)
+
+        threading.Thread(target=decode_batches, daemon=True).start()
+        for decoded in iter(finished.get, None):
+            if isinstance(decoded, Exception):
+                raise decoded
+            yield decoded
+        return
+
+    for batch in batches:
+        yield share_group(batch,
+                          store_batch(batch, vin_decode_batch(batch)))
+
+
+# Decodes the engines of many VINs, see decode_engine_stream.
+# Returns a {vin: DecodeResult} dict, failed VINs are left out.
+def decode_engine_batch(vins, engine=None, makes=None, share=True):
+    engines = {}
+    for _, decoded in decode_engine_stream(vins, engine, makes, share):
+        engines.update(decoded)
+    return engines
@@ -0,0 +1,141 @@
+import glob
+import gzip
+import os
+import pandas as pd
+
+# Inventory history, kept as the vehicles added to and removed from each
+# yard on every update (keyed by VIN) instead of full copies. Changes are
+# appended to one gzipped CSV per yard per day:
+#   data_cache/history/{location}/{YYYY-MM-DD}.csv.gz
+# with the columns Date, Change ('added' or 'removed') and the inventory
+# columns. The first update of each month also saves the yard's whole
+# inventory as a checkpoint:
+#   data_cache/history/{location}/checkpoints/{update time}.csv.gz
+# so looking up a past inventory only replays the changes since the
+# nearest checkpoint.
+
+HISTORY_DIR = os.path.join('data_cache', 'history')
+# Inventory columns kept in the history
+HISTORY_COLUMNS = ['Row', 'Vin', 'Year', 'Make', 'Model']
+# Checkpoint file names, the update time to the microsecond
+CHECKPOINT_FORMAT = '%Y-%m-%dT%H%M%S.%f'
+
+
+def history_dir(location_name):
+    return os.path.join(HISTORY_DIR, location_name)
+
+
+def has_history(location_name):
+    return bool(glob.glob(os.path.join(history_dir(location_name),
+                                       '*.csv.gz')))
+
+
+def checkpoint_dir(location_name):
+    return os.path.join(history_dir(location_name), 'checkpoints')
+
+
+# A yard's checkpoints as {time: file path}, oldest first
+def checkpoints(location_name):
+    file_paths = glob.glob(os.path.join(checkpoint_dir(location_name),
+                                        '*.csv.gz'))
+    return {pd.to_datetime(os.path.basename(file_path)[:-len('.csv.gz')],
+                           format=CHECKPOINT_FORMAT): file_path
+            for file_path in sorted(file_paths)}
+
+
+# Appends one update's added/removed vehicles to the day's history file.
+# Given the yard's inventory after the update, it's also saved as a
+# checkpoint if there isn't one for that month yet.
+def record_changes(location_name, added, removed, date=None, inventory=None):
+    date = pd.Timestamp(date or pd.Timestamp.now())
+    if inventory is not None and not any(
+            checkpoint.strftime('%Y-%m') == date.strftime('%Y-%m')
+            for checkpoint in checkpoints(location_name)):
+        write_checkpoint(location_name, inventory, date)
+    if added.empty and removed.empty:
+        return
+    changes = pd.concat([added[HISTORY_COLUMNS].assign(Change='added'),
+                         removed[HISTORY_COLUMNS].assign(Change='removed')
+                         ])
+    changes.insert(0, 'Date', date.isoformat())
+
+    if not os.path.exists(history_dir(location_name)):
+        os.makedirs(history_dir(location_name))
+    file_path = os.path.join(history_dir(location_name),
+                             f'{date.date().isoformat()}.csv.gz'
+                             )
+    new_file = not os.path.exists(file_path)
+    # Every append is its own gzip member, readers see them as one file
+    with gzip.open(file_path, 'at', newline='') as file:
+        changes.to_csv(file, header=new_file, index=False)
+
+
+def write_checkpoint(location_name, inventory, date):
+    if not os.path.exists(checkpoint_dir(location_name)):
+        os.makedirs(checkpoint_dir(location_name))
+    file_path = os.path.join(checkpoint_dir(location_name),
+                             f'{date.strftime(CHECKPOINT_FORMAT)}.csv.gz'
+                             )
+    # Written next to the checkpoint and swapped in, so a reader never
+    # sees half of one
+    with gzip.open(f'{file_path}.tmp', 'wt', newline='') as file:
+        inventory[HISTORY_COLUMNS].to_csv(file, index=False)
+    os.replace(f'{file_path}.tmp', file_path)
+
+
+# Reads a yard's changes in order, only opening the days from start to end
+def read_history(location_name, start=None, end=None):
+    start_day = pd.Timestamp(start).date().isoformat() if start else ''
+    end_day = pd.Timestamp(end).date().isoformat() if end else '~'
+    frames = []
+    for file_path in sorted(glob.glob(os.path.join(history_dir(location_name),
+                                                   '*.csv.gz'))):
+        day = os.path.basename(file_path)[:-len('.csv.gz')]
+        if start_day <= day <= end_day:
+            frames.append(pd.read_csv(file_path, dtype={'Vin': str}))
+    if not frames:
+        return pd.DataFrame(columns=['Date', *HISTORY_COLUMNS, 'Change'])
+    changes = pd.concat(frames, ignore_index=True)
+    changes['Date'] = pd.to_datetime(changes['Date'], format='ISO8601')
+    return changes
+
+
+# Vehicles whose last change among the given changes was being added
+def still_added(changes):
+    last_changes = changes.drop_duplicates('Vin', keep='last')
+    return last_changes[last_changes['Change'] == 'added'].drop(
+        columns='Change'
+    ).reset_index(drop=True)
+
+
+# What was in the yard at the end of the given day (or at the given time).
+# Starts from the last checkpoint before then and replays the changes since.
+def inventory_on(location_name, date):
+    date = pd.Timestamp(date)
+    # A day without a time means the end of that day
+    end = date + pd.Timedelta(days=1) if date == date.normalize() else date
+    earlier = {checkpoint: file_path
+               for checkpoint, file_path in checkpoints(location_name).items()
+               if checkpoint < end}
+    if not earlier:
+        changes = read_history(location_name, end=end)
+    else:
+        start, file_path = list(earlier.items())[-1]
+        vehicles = pd.read_csv(file_path, dtype={'Vin': str}).assign(
+            Date=start,
+            Change='added'
+        )
+        changes = read_history(location_name, start=start, end=end)
+        # The checkpoint already has the changes of its own update
+        changes = pd.concat([vehicles[changes.columns],
+                             changes[changes['Date'] > start]
+                             ], ignore_index=True)
+    return still_added(changes[changes['Date'] < end]).drop(columns='Date')
+
+
+# Vehicles that arrived since the given date or time and are still in the
+# yard, with the Date they arrived
+def arrivals_since(location_name, since):
+    since = pd.Timestamp(since)
+    changes = read_history(location_name, start=since)
+    return still_added(changes[changes['Date'] >= since])
@@ -0,0 +1,469 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+from decoder import (DecodeResult,
+                     decode_engine_batch,
+                     decode_engine_stream,
+                     offline_decoder,
+                     vin_cache
+                     )
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    # Without pyarrow inventories are only stored as CSV
+    feather = None
+
+
+# Column types in the Feather inventory store
+INVENTORY_DTYPES = {'Vin': str,
+                    'Year': 'Int64',
+                    'Make': 'category',
+                    'Model': 'category'
+                    }
+
+
+# Reads a yard inventory, preferring the Feather store over the CSV export
+def read_inventory(file):
+    stem = os.path.splitext(file)[0]
+    feather_path = os.path.join('data_cache', f'{stem}.feather')
+    if feather is not None and os.path.exists(feather_path):
+        # Uncompressed Feather files are memory mapped instead of parsed
+        return feather.read_table(feather_path, memory_map=True).to_pandas()
+    return pd.read_csv(os.path.join('data_cache', file))
+
+
+# Writes a yard inventory to data_cache as Feather (when pyarrow is
+# installed) plus a CSV export
+def write_inventory(location_name, yard_inventory):
+    if not os.path.exists('data_cache'):
+        os.makedirs('data_cache')
+
+    if feather is not None:
+        typed_inventory = yard_inventory.reset_index(drop=True).astype(
+            INVENTORY_DTYPES
+        )
+        feather_path = os.path.join('data_cache',
+                                    f'{location_name}_inventory.feather')
+        # Written next to the old file and swapped in, so inventories that
+        # are still memory mapped or being read never see a partial file
+        feather.write_feather(typed_inventory,
+                              feather_path + '.tmp',
+                              compression='uncompressed'
+                              )
+        os.replace(feather_path + '.tmp', feather_path)
+    yard_inventory.to_csv(
+        os.path.join('data_cache', f'{location_name}_inventory.csv'),
+        index=False
+    )
+
+
+# Fields stored per vehicle once its VIN is decoded
+ENGINE_FIELDS = list(DecodeResult.FIELDS)
+
+
+# Turns a {vin: DecodeResult} dict into a frame indexed by VIN
+def engine_frame(engines):
+    engine_df = pd.DataFrame(
+        [engine.values() for engine in engines.values()],
+        columns=ENGINE_FIELDS,
+        index=pd.Index(list(engines), name='Vin'),
+        dtype=object
+    )
+    engine_df['Liters'] = pd.to_numeric(engine_df['Liters'])
+    return engine_df
+
+
+# Fills in the engine columns of an inventory from a VIN indexed frame,
+# all rows at once. Engines that are already there are kept.
+def fill_engines(inventory, engine_df):
+    inventory = inventory.copy()
+    engine_df = engine_df[~engine_df.index.duplicated()]
+    for field in ENGINE_FIELDS:
+        decoded = inventory['Vin'].map(engine_df[field])
+        if field in inventory.columns:
+            decoded = inventory[field].where(inventory[field].notna(),
+                                             decoded
+                                             )
+        inventory[field] = decoded
+    return inventory
+
+
+# VINs without engine data. Liters is always set once a VIN is decoded.
+def undecoded_vins(inventory):
+    if 'Liters' not in inventory.columns:
+        return inventory['Vin'].tolist()
+    return inventory.loc[inventory['Liters'].isna(), 'Vin'].tolist()
+
+
+# {vin: make} for the decode planner's per-make settings
+def vin_makes(inventory):
+    return dict(zip(inventory['Vin'], inventory['Make'].astype(str)))
+
+
+# Make names as they're listed on the yard sites
+MAKE_ALIASES = {'CHEVY': 'CHEVROLET',
+                'NISSAN': 'DATSUN - NISSAN',
+                'DATSUN': 'DATSUN - NISSAN'
+                }
+# Columns that only exist after the VINs are decoded
+ENGINE_COLUMNS = ('Liters', 'Cylinders')
+
+
+# Turns a search value into a (low, high) range. Takes a single value,
+# a 'low-high' string like '2000-2005' or a (low, high) tuple.
+def parse_range(value, cast):
+    if isinstance(value, (tuple, list)):
+        low, high = value
+    elif isinstance(value, str) and '-' in value.strip()[1:]:
+        low, high = value.strip().split('-', 1)
+    else:
+        low = high = value
+    return cast(low), cast(high)
+
+
+# Builds the mask for one search filter
+def column_mask(column, low, high):
+    if not isinstance(low, str) and not is_numeric_dtype(column):
+        # Decoded cylinder counts come back from the API as text
+        column = pd.to_numeric(column, errors='coerce')
+    if low == high:
+        return column == low
+    return column.between(low, high)
+
+
+# Composable inventory search. Each filter is a (column, low, high)
+# predicate, every predicate has to match.
+class Query:
+    def __init__(self,
+                 year=None,
+                 make=None,
+                 model=None,
+                 displacement=None,
+                 cylinders=None,
+                 location=None
+                 ):
+        self.predicates = []
+        if year:
+            self.where('Year', year, int)
+        if make:
+            make = str(make).upper()
+            self.where('Make', MAKE_ALIASES.get(make, make))
+        if model:
+            self.where('Model', str(model).upper())
+        if displacement:
+            self.where('Liters', displacement, float)
+        if cylinders:
+            self.where('Cylinders', cylinders, int)
+        if location:
+            self.where('Location', location)
+
+    # Adds a filter on any column, value can be a range for numeric columns
+    def where(self, column, value, cast=str):
+        if cast is str:
+            low = high = value
+        else:
+            low, high = parse_range(value, cast)
+        self.predicates.append((column, low, high))
+        return self
+
+    def inventory_predicates(self):
+        return tuple(predicate for predicate in self.predicates
+                     if predicate[0] not in ENGINE_COLUMNS)
+
+    def engine_predicates(self):
+        return tuple(predicate for predicate in self.predicates
+                     if predicate[0] in ENGINE_COLUMNS)
+
+    def has_column(self, column):
+        return any(predicate[0] == column for predicate in self.predicates)
+
+    def needs_decode(self):
+        return bool(self.engine_predicates())
+
+    # Engine searches are only allowed with a make, decoding the whole
+    # inventory would take far too long
+    def is_valid(self):
+        return not self.needs_decode() or self.has_column('Make')
+
+    def describe(self):
+        units = {'Liters': 'L', 'Cylinders': 'cyl'}
+        words = []
+        for column, low, high in self.predicates:
+            value = f'{low}' if low == high else f'{low}-{high}'
+            words.append(value + units.get(column, ''))
+        return ' '.join(words)
+
+    @staticmethod
+    def mask(df, predicates):
+        mask = pd.Series(True, index=df.index)
+        for column, low, high in predicates:
+            mask &= column_mask(df[column], low, high)
+        return mask
+
+
+class Inventory:
+    # Column groups that get a hash index of row positions at load time
+    INDEXES = (('Year',), ('Make',), ('Model',), ('Make', 'Model'),
+               ('Location',))
+
+    def __init__(self, file, inventory=None):
+        self.file = file
+        self.location = file.split('_')[0]
+
+        if inventory is None:
+            inventory = read_inventory(self.file)
+        self.inventory = inventory.reset_index(drop=True)
+        # Single yard inventories are stored without a Location column
+        if 'Location' not in self.inventory.columns:
+            self.inventory['Location'] = self.location
+        self.positions_cache = {}
+        self.indexes = {}
+        self.build_indexes()
+        # Every engine was decoded at scrape time, so engine searches
+        # don't need the API and can run without a make
+        self.decoded = not undecoded_vins(self.inventory)
+
+    # Stores Make/Model/Location as categories and maps every value (or
+    # value pair) to its row positions, so equality filters on them are
+    # O(matches)
+    def build_indexes(self):
+        for column in ('Make', 'Model', 'Location'):
+            self.inventory[column] = self.inventory[column].astype('category')
+        for columns in self.INDEXES:
+            groups = self.inventory.groupby(list(columns),
+                                            observed=True,
+                                            sort=False
+                                            ).indices
+            if len(columns) == 1:
+                groups = {(key,): positions
+                          for key, positions in groups.items()}
+            self.indexes[columns] = groups
+
+    # Looks up the row positions of an indexed value, or of every indexed
+    # value in a range
+    def index_lookup(self, columns, low, high):
+        index = self.indexes[columns]
+        if low == high:
+            return index.get(low, np.empty(0, dtype=np.intp))
+        return np.concatenate(
+            [np.empty(0, dtype=np.intp)] +
+            [positions for key, positions in index.items()
+             if low[0] <= key[0] <= high[0]]
+        )
+
+    # Adds the decoded engine columns (ENGINE_FIELDS) to the given results,
+    # only decoding the VINs that weren't decoded at scrape time
+    @staticmethod
+    def decode_engines(results, engine=None):
+        vin_cache.reset_counters()
+        offline_decoder.reset_counters()
+        engines = decode_engine_batch(undecoded_vins(results),
+                                      engine,
+                                      vin_makes(results)
+                                      )
+        df_copy = fill_engines(results, engine_frame(engines))
+
+        cache_message = (f'VIN cache: {vin_cache.hits} hits, '
+                         f'{vin_cache.misses} misses, '
+                         f'offline patterns: {offline_decoder.hits} hits')
+        print(cache_message)
+        return df_copy
+
+    # Finds (or reuses) the row positions matching the yard site filters of
+    # a query. Counting and then searching the same query does the work once.
+    def inventory_positions(self, query):
+        predicates = query.inventory_predicates()
+        if predicates in self.positions_cache:
+            return self.positions_cache[predicates]
+
+        # Candidate row positions from each usable index, with the
+        # predicates each one answers
+        equal = {column: low for column, low, high in predicates
+                 if low == high}
+        candidates = []
+        if 'Make' in equal and 'Model' in equal:
+            key = (equal['Make'], equal['Model'])
+            candidates.append((
+                self.index_lookup(('Make', 'Model'), key, key),
+                [predicate for predicate in predicates
+                 if predicate[0] in ('Make', 'Model')]
+            ))
+        for column, low, high in predicates:
+            if (column,) in self.indexes:
+                candidates.append((
+                    self.index_lookup((column,), (low,), (high,)),
+                    [(column, low, high)]
+                ))
+
+        # Start from the most selective index, the other predicates are
+        # only checked against those rows
+        if candidates:
+            positions, answered = min(candidates,
+                                      key=lambda candidate: len(candidate[0])
+                                      )
+            positions = np.sort(positions)
+        else:
+            positions, answered = np.arange(len(self.inventory)), []
+        remaining = [predicate for predicate in predicates
+                     if predicate not in answered]
+
+        for column, low, high in remaining:
+            values = self.inventory[column].iloc[positions]
+            positions = positions[column_mask(values, low, high).to_numpy()]
+
+        if len(self.positions_cache) > 32:
+            self.positions_cache.clear()
+        self.positions_cache[predicates] = positions
+        return positions
+
+    def count(self, query):
+        return len(self.inventory_positions(query))
+
+    # Vehicles matching the query's inventory filters that still need
+    # their VIN decoded for an engine search
+    def decode_count(self, query):
+        if not query.needs_decode():
+            return 0
+        return len(set(undecoded_vins(
+            self.inventory.iloc[self.inventory_positions(query)]
+        )))
+
+    def query(self, query, engine=None):
+        if not query.is_valid() and not self.decoded:
+            return 'Invalid search parameters'
+
+        results = self.inventory.iloc[self.inventory_positions(query)]
+        if not query.needs_decode():
+            return results
+
+        undecoded_count = len(undecoded_vins(results))
+        if undecoded_count:
+            api_message = (f'Sending {undecoded_count} '
+                           f'items to NHTSA API.'
+                           f'\nThis may take a few moments...')
+            print(api_message)
+
+        df_copy = self.decode_engines(results, engine)
+        out_put_df = df_copy[Query.mask(df_copy, query.engine_predicates())]
+
+        return out_put_df
+
+    # Streaming version of query(). Yields (matches, decoded, total) as
+    # soon as each part of the VINs is decoded, so the first vehicles can be
+    # shown long before the whole search is done. matches are the new
+    # matching rows, decoded/total count the VINs sent to be decoded.
+    # Vehicles that were already decoded come first.
+    def query_stream(self, query, engine=None):
+        if not query.is_valid() and not self.decoded:
+            return
+
+        results = self.inventory.iloc[self.inventory_positions(query)]
+        if not query.needs_decode():
+            yield results, 0, 0
+            return
+
+        predicates = query.engine_predicates()
+        # A VIN listed in more than one yard is only decoded once
+        vins = list(dict.fromkeys(undecoded_vins(results)))
+        undecoded = results['Vin'].isin(vins)
+        # Filled with nothing, only so every part has the engine columns
+        decoded_rows = fill_engines(results[~undecoded], engine_frame({}))
+        yield decoded_rows[Query.mask(decoded_rows, predicates)], 0, len(vins)
+
+        pending = results[undecoded]
+        decoded_count = 0
+        for batch, engines in decode_engine_stream(vins,
+                                                   engine,
+                                                   vin_makes(pending)
+                                                   ):
+            decoded_count += len(batch)
+            rows = fill_engines(pending[pending['Vin'].isin(engines)],
+                                engine_frame(engines)
+                                )
+            yield rows[Query.mask(rows, predicates)], decoded_count, len(vins)
+
+    def search(self,
+               year=None,
+               make=None,
+               model=None,
+               displacement=None,
+               cylinders=None,
+               stream=False
+               ):
+        query = Query(year=year,
+                      make=make,
+                      model=model,
+                      displacement=displacement,
+                      cylinders=cylinders
+                      )
+        if stream:
+            return self.query_stream(query)
+        return self.query(query)
+
+    def api_search_count(self, year=None, make=None, model=None):
+        return self.count(Query(year=year, make=make, model=model))
+
+
+# Stacks yard inventories into one table with a Location column
+def combine_inventories(yard_inventories):
+    return pd.concat(
+        [yard_inventory.assign(Location=location_name)
+         for location_name, yard_inventory in yard_inventories.items()],
+        ignore_index=True
+    )
+
+
+# One yard's rows of a combined inventory, without the Location column
+def location_rows(inventory, location_name):
+    return inventory[inventory['Location'] == location_name].drop(
+        columns='Location'
+    )
+
+
+# Keeps yard Inventories loaded between searches. An inventory is only
+# reloaded when its stored files change or the scraper invalidates it.
+class InventoryManager:
+    def __init__(self):
+        self.inventories = {}
+        self.lock = threading.Lock()
+
+    # Last change time of a yard's stored inventory (Feather or CSV)
+    @staticmethod
+    def store_mtime(file):
+        stem = os.path.splitext(file)[0]
+        mtimes = [os.path.getmtime(path)
+                  for path in (os.path.join('data_cache', f'{stem}.feather'),
+                               os.path.join('data_cache', file))
+                  if os.path.exists(path)]
+        return max(mtimes, default=None)
+
+    # One Inventory over several yards, searched and decoded in one pass.
+    # Rebuilt when any of the yards changes.
+    def get_all(self, location_names):
+        files = tuple(f'{location_name}_inventory.csv'
+                      for location_name in location_names)
+        with self.lock:
+            mtimes = tuple(self.store_mtime(file) for file in files)
+            loaded = self.inventories.get(files)
+            if loaded is None or loaded[0] != mtimes:
+                combined = combine_inventories(
+                    {location_name: read_inventory(file)
+                     for location_name, file in zip(location_names, files)}
+                )
+                loaded = (mtimes, Inventory('All_inventory.csv', combined))
+                self.inventories[files] = loaded
+            return loaded[1]
+
+    def invalidate(self, file=None):
+        with self.lock:
+            if file is None:
+                self.inventories.clear()
+            else:
+                # Combined inventories that include the yard
+                for key in [key for key in self.inventories if file in key]:
+                    del self.inventories[key]
+
+
+inventory_manager = InventoryManager()
@@ -0,0 +1,100 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Min seconds between two requests to the same host
+HOST_REQUEST_INTERVAL = 0.1
+
+
+# Spaces out requests to each host so we stay polite to the yard sites
+# no matter how many worker threads are scraping. URLs under a prefix
+# given to set_interval() are also spaced out by that prefix's interval.
+class HostRateLimiter:
+    def __init__(self, interval=HOST_REQUEST_INTERVAL):
+        self.interval = interval
+        self.prefix_intervals = {}
+        self.lock = threading.Lock()
+        self.next_request = {}
+
+    def set_interval(self, url_prefix, interval):
+        with self.lock:
+            self.prefix_intervals[url_prefix] = interval
+
+    # Books the next request slot for the URL's host (and prefixes) and
+    # returns how many seconds to wait for it
+    def reserve(self, url):
+        limits = [(urlparse(url).netloc, self.interval)]
+        with self.lock:
+            limits += [(prefix, interval)
+                       for prefix, interval in self.prefix_intervals.items()
+                       if url.startswith(prefix)]
+            now = time.monotonic()
+            request_time = max([now] + [self.next_request.get(key, now)
+                                        for key, _ in limits])
+            for key, interval in limits:
+                self.next_request[key] = request_time + interval
+        return request_time - now
+
+    def wait(self, url):
+        time.sleep(self.reserve(url))
+
+
+host_limiter = HostRateLimiter()
+
+
+# Shared HTTP session settings
+# Connections kept open per host, should cover SCRAPE_WORKERS for every yard
+HTTP_POOL_SIZE = 16
+# Retries on connection errors and 429/5xx responses
+HTTP_RETRIES = 3
+# Retry delays grow as HTTP_BACKOFF * 2^n seconds
+HTTP_BACKOFF = 0.5
+# Responses that are retried, honoring their Retry-After header
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Seconds to wait before retry number attempt + 1. A Retry-After header
+# (seconds or an HTTP date) takes the place of the backoff.
+def retry_delay(attempt, retry_after=None, backoff=HTTP_BACKOFF):
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                pass
+            else:
+                return max(0.0, retry_at.timestamp() - time.time())
+    return backoff * 2 ** attempt
+
+
+# Builds a session that keeps connections alive between requests and retries
+# throttled or failed requests with backoff
+def make_session(pool_size=HTTP_POOL_SIZE,
+                 retries=HTTP_RETRIES,
+                 backoff=HTTP_BACKOFF
+                 ):
+    retry = Retry(total=retries,
+                  backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES,
+                  allowed_methods=None,
+                  raise_on_status=False
+                  )
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size,
+                          max_retries=retry
+                          )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Used by both the yard scraper and the VIN decoder
+http_session = make_session()
@@ -0,0 +1,120 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the two NHTSA vPIC endpoints the decoder uses,
+# DecodeVINValuesBatch and decodevin, answering from SAMPLE_ENGINES so the
+# decoder can be checked without the real API.
+#   python nhtsa_server.py 8000
+#   set NHTSA_API_URL=http://127.0.0.1:8000
+
+# VIN characters 1-8 -> batch result fields. Other VINs decode to blank
+# fields, like VINs the API doesn't know.
+SAMPLE_ENGINES = {
+    'JF1BE6LC': {'DisplacementL': '2.457278', 'EngineCylinders': '4',
+                 'EngineModel': 'EJ25', 'FuelTypePrimary': 'Gasoline',
+                 'TransmissionStyle': 'Automatic', 'DriveType': 'AWD',
+                 'Trim': 'GT'},
+    '4T1BF22K': {'DisplacementL': '2.995', 'EngineCylinders': '6',
+                 'EngineModel': '1MZ-FE', 'FuelTypePrimary': 'Gasoline',
+                 'TransmissionStyle': 'Automatic', 'DriveType': 'FWD',
+                 'Trim': 'XLE'},
+    '1G1ND52J': {'DisplacementL': '2.2', 'EngineCylinders': '4',
+                 'EngineModel': 'L61', 'FuelTypePrimary': 'Gasoline',
+                 'TransmissionStyle': 'Manual', 'DriveType': 'FWD',
+                 'Trim': ''},
+}
+# Batch result key -> decodevin Variable
+VARIABLES = {'DisplacementL': 'Displacement (L)',
+             'EngineCylinders': 'Engine Number of Cylinders',
+             'EngineModel': 'Engine Model',
+             'FuelTypePrimary': 'Fuel Type - Primary',
+             'TransmissionStyle': 'Transmission Style',
+             'DriveType': 'Drive Type',
+             'Trim': 'Trim'
+             }
+
+
+def batch_result(vin):
+    fields = SAMPLE_ENGINES.get(vin[:8].upper(), {})
+    return {'VIN': vin, **{key: fields.get(key, '') for key in VARIABLES}}
+
+
+class NHTSAHandler(BaseHTTPRequestHandler):
+    # GET /decodevin/{vin}?format=json
+    def do_GET(self):
+        self.server.requests.append(('decodevin', 1))
+        if self.throttled():
+            return
+        path = urlparse(self.path).path.rstrip('/').split('/')
+        if len(path) < 2 or path[-2].lower() != 'decodevin':
+            self.send_error(404)
+            return
+        result = batch_result(path[-1])
+        self.send_json([{'Variable': variable, 'Value': result[key] or None}
+                        for key, variable in VARIABLES.items()])
+
+    # POST /DecodeVINValuesBatch/ with format=json&data=VIN;VIN;...
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        vins = [vin for vin in form.get('data', [''])[0].split(';') if vin]
+        self.server.requests.append(('batch', len(vins)))
+        if self.throttled():
+            return
+        if 'decodevinvaluesbatch' not in self.path.lower():
+            self.send_error(404)
+            return
+        self.send_json([batch_result(vin) for vin in vins])
+
+    # Answers 429 while the server still has throttled responses to give
+    def throttled(self):
+        with self.server.lock:
+            if self.server.throttle <= 0:
+                return False
+            self.server.throttle -= 1
+        self.send_response(429)
+        self.send_header('Retry-After', '0')
+        self.end_headers()
+        return True
+
+    def send_json(self, results):
+        body = json.dumps({'Count': len(results),
+                           'Results': results
+                           }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# Serves on a background thread. Returns the server, its requests list
+# records (endpoint, VIN count) for each request and setting throttle to n
+# makes the next n requests get a 429.
+def start_server(port=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), NHTSAHandler)
+    server.requests = []
+    server.throttle = 0
+    server.lock = threading.Lock()
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    server = start_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print(f'Serving NHTSA stand-in at {server_url(server)}, Ctrl+C to stop')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
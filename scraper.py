@@ -0,0 +1,494 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import (CancelledError,
+                                ProcessPoolExecutor,
+                                ThreadPoolExecutor,
+                                as_completed
+                                )
+import lxml.html
+import pandas as pd
+from decoder import decode_engine_batch
+from history import has_history, record_changes
+from inventory import (ENGINE_FIELDS,
+                       engine_frame,
+                       fill_engines,
+                       inventory_manager,
+                       read_inventory,
+                       undecoded_vins,
+                       vin_makes,
+                       write_inventory
+                       )
+from network import host_limiter, http_session
+from watchlist import check_watches
+
+
+# Yard site scraping settings
+SCRAPE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                  'AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/123.0.0.0 Safari/537.36'
+}
+# Vehicles listed per yard inventory page
+PAGE_SIZE = 50
+# Max pages fetched at the same time for one yard, unless the yard sets
+# its own "workers"
+SCRAPE_WORKERS = 8
+# Yard registry, a JSON file listing every yard to track
+YARDS_FILE = os.environ.get(
+    'YARDS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yards.json')
+)
+# Max yards scraped at the same time by refresh_yards()
+YARD_PROCESSES = 4
+
+
+# Reads the yard registry. Each yard has a "name" and the "url" of its
+# inventory page, and optionally "workers" (pages fetched at the same time)
+# and "request_interval" (min seconds between requests to that yard).
+# Returns {name: {'url': ..., 'workers': ..., 'request_interval': ...}}
+# Raises ValueError if the registry is missing or malformed.
+def load_yards(file_path=YARDS_FILE):
+    try:
+        with open(file_path) as file:
+            registry = json.load(file)
+        yards = {}
+        for yard in registry['yards']:
+            yards[yard['name']] = {
+                'url': yard['url'],
+                'workers': yard.get('workers', SCRAPE_WORKERS),
+                'request_interval': yard.get('request_interval')
+            }
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        raise ValueError(f'Could not read the yard registry {file_path}: '
+                         f'{type(error).__name__}: {error}') from error
+
+    for yard in yards.values():
+        if yard['request_interval'] is not None:
+            host_limiter.set_interval(yard['url'], yard['request_interval'])
+    return yards
+
+
+# Yards scraped when updating the inventory, read from YARDS_FILE the first
+# time get_yards() is called so importing doesn't need the registry
+yard_registry = None
+yard_registry_lock = threading.Lock()
+
+
+def get_yards():
+    global yard_registry
+    with yard_registry_lock:
+        if yard_registry is None:
+            yard_registry = load_yards()
+        return yard_registry
+
+
+# Held while a yard's stored inventory is being rewritten
+store_locks = defaultdict(threading.Lock)
+
+
+# Columns kept from the yard inventory tables
+INVENTORY_COLUMNS = ['Row', 'Vin', 'Year', 'Make', 'Model']
+
+
+# Gets the total number of table pages from a yard inventory page
+def parse_page_count(content):
+    document = lxml.html.fromstring(content)
+    input_tags = document.xpath(
+        '//input[contains(concat(" ", normalize-space(@class), " "), '
+        '" form-control ")]'
+    )
+    page_tag = input_tags[1]
+    return int(page_tag.get('data-pagecount'))
+
+
+# Pulls the inventory columns out of a yard inventory page in a single pass
+# over the table rows
+def parse_inventory_table(content):
+    document = lxml.html.fromstring(content)
+    table = document.xpath(
+        '//table[contains(concat(" ", normalize-space(@class), " "), '
+        '" table ")]'
+    )[0]
+    rows = table.iter('tr')
+    headers = [cell.text_content().strip() for cell in next(rows)]
+    positions = [headers.index(column) for column in INVENTORY_COLUMNS]
+
+    columns = [[] for _ in INVENTORY_COLUMNS]
+    for row in rows:
+        cells = row.findall('td')
+        if len(cells) < len(headers):
+            continue
+        for values, position in zip(columns, positions):
+            values.append(cells[position].text_content().strip())
+
+    table = pd.DataFrame(dict(zip(INVENTORY_COLUMNS, columns)))
+    # A blank or garbled cell becomes NaN instead of leaving the column as
+    # strings, which the Int64 Year column can't be written from
+    for column in ('Row', 'Year'):
+        table[column] = pd.to_numeric(table[column], errors='coerce')
+    return table
+
+
+# Scrapes the vehicle table from one page of a yard inventory.
+# Returns (status code, table), table is None if the request failed.
+def scrape_page(url, start_index):
+    url_index = url + f'?start={start_index}'
+    host_limiter.wait(url_index)
+    response = http_session.get(url_index, headers=SCRAPE_HEADERS)
+
+    if response.status_code != 200:
+        return response.status_code, None
+
+    return response.status_code, parse_inventory_table(response.content)
+
+
+# Compares two scrapes of a yard by VIN. Returns (added, removed) vehicles.
+def diff_inventory(previous_inventory, current_inventory):
+    if previous_inventory is None:
+        return current_inventory, current_inventory.iloc[0:0]
+    added = current_inventory[
+        ~current_inventory['Vin'].isin(previous_inventory['Vin'])
+    ]
+    removed = previous_inventory[
+        ~previous_inventory['Vin'].isin(current_inventory['Vin'])
+    ]
+    return added, removed
+
+
+# Scrapes a yard's inventory into data_cache. The URL and workers default
+# to the yard's registry settings. Messages go to report() and
+# page progress to progress(location_name, pages_done, page_count).
+# Pages are fetched on a thread pool, or on the given AsyncEngine.
+# New arrivals are checked against the watchlist. With predecode the new
+# VINs are decoded in the background afterwards.
+# Returns the (added, removed) vehicles since the last scrape.
+def make_file(location_name,
+              url=None,
+              max_workers=None,
+              incremental=False,
+              report=print,
+              progress=None,
+              engine=None,
+              predecode=False
+              ):
+    # SETTINGS FROM THE YARD REGISTRY UNLESS GIVEN
+    if url is None or max_workers is None:
+        yard = get_yards().get(location_name, {})
+        if url is None and 'url' not in yard:
+            raise ValueError(f'{location_name} is not in the yard registry '
+                             f'{YARDS_FILE}')
+        url = url or yard['url']
+        max_workers = max_workers or yard.get('workers', SCRAPE_WORKERS)
+
+    init_message = (
+        f'Initializing request for {location_name} location...\n'
+    )
+    report(init_message)
+
+    init_fail = 'Initiation failed!\n'
+    seperator = '\n---------------\n'
+
+    # CALL REQUEST TO WEBSITE
+    host_limiter.wait(url)
+    response = http_session.get(url, headers=SCRAPE_HEADERS)
+
+    if response.status_code == 200:
+        # GET TOTAL TABLE PAGES
+        page_count = parse_page_count(response.content)
+
+    else:
+        # GET REQUEST FAILED
+        get_request_failed = (
+            f"{init_fail}Failed to fetch data from the URL: {url}"
+            f"\nResponse Status: {response.status_code}{seperator}")
+        report(get_request_failed)
+        return
+
+    # CONSTRUCT FULL FILE PATH
+    file_path = os.path.join('data_cache',
+                             f'{location_name}_inventory.csv'
+                             )
+    previous_inventory = None
+    if os.path.exists(file_path):
+        previous_inventory = read_inventory(
+            f'{location_name}_inventory.csv'
+        )
+
+    # SCRAPE TABLE PAGES CONCURRENTLY
+    scraping_message = (
+        f'Scraping {page_count} pages from the '
+        f'{location_name} yard site.\n'
+    )
+    report(scraping_message)
+
+    if incremental and previous_inventory is not None:
+        # SCRAPE A WAVE OF PAGES AT A TIME (NEWEST FIRST) AND STOP ONCE
+        # A PAGE ONLY HAS VEHICLES WE ALREADY KNOW ABOUT
+        known_vins = set(previous_inventory['Vin'])
+        page_data = {}
+        failed_pages = 0
+        for wave_start in range(0, page_count, max_workers):
+            wave = range(wave_start,
+                         min(wave_start + max_workers, page_count)
+                         )
+            wave_data, wave_failed = scrape_pages(location_name,
+                                                  url,
+                                                  wave,
+                                                  page_count,
+                                                  max_workers,
+                                                  len(page_data),
+                                                  report,
+                                                  progress,
+                                                  engine
+                                                  )
+            page_data.update(wave_data)
+            failed_pages += wave_failed
+            if wave_failed or any(
+                    wave_data[page_index]['Vin'].isin(known_vins).all()
+                    for page_index in wave
+            ):
+                break
+        stopped_early = len(page_data) < page_count
+    else:
+        page_data, failed_pages = scrape_pages(location_name,
+                                               url,
+                                               range(page_count),
+                                               page_count,
+                                               max_workers,
+                                               report=report,
+                                               progress=progress,
+                                               engine=engine
+                                               )
+        stopped_early = False
+
+    if failed_pages:
+        # DON'T OVERWRITE THE LAST INVENTORY WITH A PARTIAL ONE
+        incomplete_message = (
+            f'{init_fail}{failed_pages} {location_name} pages failed, '
+            f'keeping the previous inventory.{seperator}'
+        )
+        report(incomplete_message)
+        return
+
+    # ALL YARD DATA, IN PAGE ORDER
+    yard_inventory = pd.concat(
+        [page_data[page_index] for page_index in sorted(page_data)]
+    )
+    if stopped_early:
+        # THE PREVIOUS INVENTORY PAST THE LAST KNOWN VEHICLE WE SCRAPED IS
+        # THE PART WE DIDN'T SCRAPE, IT'S THE SAME AS LAST TIME. VEHICLES
+        # MISSING BEFORE THAT POINT LEFT THE YARD.
+        seen = previous_inventory['Vin'].isin(yard_inventory['Vin'])
+        seen_positions = seen.to_numpy().nonzero()[0]
+        unscraped_start = seen_positions[-1] + 1 if len(seen_positions) else 0
+        unscraped = previous_inventory.iloc[unscraped_start:]
+        yard_inventory = pd.concat([
+            yard_inventory,
+            unscraped[~unscraped['Vin'].isin(yard_inventory['Vin'])]
+        ])
+
+    # RECORD ADDED/REMOVED VEHICLES SINCE THE LAST SCRAPE IN THE HISTORY
+    if previous_inventory is not None and not has_history(location_name):
+        # YARDS SCRAPED BEFORE THERE WAS A HISTORY START FROM THEIR LAST
+        # INVENTORY
+        stored_time = inventory_manager.store_mtime(
+            f'{location_name}_inventory.csv'
+        )
+        record_changes(location_name,
+                       previous_inventory,
+                       previous_inventory.iloc[0:0],
+                       pd.Timestamp.fromtimestamp(stored_time)
+                       )
+    added, removed = diff_inventory(previous_inventory, yard_inventory)
+    record_changes(location_name, added, removed, inventory=yard_inventory)
+    if previous_inventory is not None:
+        changes_message = (
+            f'\n{location_name}: {added.shape[0]} vehicles added, '
+            f'{removed.shape[0]} removed since the last update.'
+        )
+        if stopped_early:
+            changes_message += (
+                f' (stopped after {len(page_data)}/{page_count} pages)'
+            )
+        report(changes_message)
+
+    # WRITE DATA TO THE INVENTORY STORE IN DATA_CACHE, KEEPING THE ENGINES
+    # DECODED FOR VEHICLES THAT ARE STILL IN THE YARD. THE STORED INVENTORY
+    # IS RE-READ UNDER THE LOCK SO ENGINES A BACKGROUND PREDECODE SAVED
+    # WHILE THIS SCRAPE RAN AREN'T LOST
+    with store_locks[location_name]:
+        if os.path.exists(file_path):
+            stored_inventory = read_inventory(
+                f'{location_name}_inventory.csv'
+            )
+            if 'Liters' in stored_inventory.columns:
+                yard_inventory = fill_engines(
+                    yard_inventory,
+                    stored_inventory.set_index('Vin').reindex(
+                        columns=ENGINE_FIELDS
+                    )
+                )
+        write_inventory(location_name, yard_inventory)
+    inventory_manager.invalidate(f'{location_name}_inventory.csv')
+
+    writing_csv_message = (
+        f'\n{yard_inventory.shape[0]} vehicles written to '
+        f'{location_name}_inventory.csv in data_cache \nfolder.'
+        f'\n{location_name} initiation complete!{seperator}'
+    )
+    report(writing_csv_message)
+
+    # CHECK THE NEW ARRIVALS AGAINST THE SAVED SEARCHES (NOT ON THE FIRST
+    # SCRAPE, EVERY VEHICLE WOULD BE NEW)
+    if previous_inventory is not None:
+        check_watches(location_name, added, engine, report)
+
+    if predecode:
+        start_predecode(location_name, engine, report)
+    return added, removed
+
+
+# Pipeline stage after make_file: decodes every VIN in a yard's stored
+# inventory that has no engine data yet and stores the decoded columns
+# (ENGINE_FIELDS) with it. Returns the number of VINs decoded.
+def predecode_inventory(location_name, engine=None, report=print):
+    file = f'{location_name}_inventory.csv'
+    yard_inventory = read_inventory(file)
+    vins = undecoded_vins(yard_inventory)
+    if not vins:
+        return 0
+
+    report(f'\nDecoding {len(vins)} {location_name} VINs in the '
+           f'background...\n')
+    engines = decode_engine_batch(vins, engine, vin_makes(yard_inventory))
+
+    with store_locks[location_name]:
+        # RE-READ IN CASE THE YARD WAS SCRAPED AGAIN WHILE DECODING
+        yard_inventory = fill_engines(read_inventory(file),
+                                      engine_frame(engines)
+                                      )
+        write_inventory(location_name, yard_inventory)
+    inventory_manager.invalidate(file)
+
+    report(f'\n{len(engines)} {location_name} engines decoded and saved.\n')
+    return len(engines)
+
+
+def start_predecode(location_name, engine=None, report=print):
+    predecode_thread = threading.Thread(target=predecode_inventory,
+                                        args=(location_name, engine, report),
+                                        daemon=True
+                                        )
+    predecode_thread.start()
+    return predecode_thread
+
+
+# Scrapes one yard in a refresh_yards() worker process
+def scrape_yard(location_name,
+                incremental=False,
+                predecode=False,
+                max_workers=None
+                ):
+    changes = make_file(location_name,
+                        max_workers=max_workers,
+                        incremental=incremental
+                        )
+    if predecode:
+        # Decoded here, a background thread would die with the process
+        predecode_inventory(location_name)
+    return changes
+
+
+# Worker processes each get their share of the per-host request rate
+def share_host_limit(processes):
+    host_limiter.interval *= processes
+
+
+# Updates many yards at once, each in its own process so page parsing
+# isn't held up by the GIL. Returns {location_name: (added, removed)},
+# None for yards that failed.
+def refresh_yards(location_names=None,
+                  processes=YARD_PROCESSES,
+                  incremental=False,
+                  predecode=False,
+                  max_workers=None
+                  ):
+    location_names = list(location_names or get_yards())
+    processes = max(1, min(processes, len(location_names)))
+    changes = {}
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=share_host_limit,
+                             initargs=(processes,)
+                             ) as executor:
+        futures = {
+            executor.submit(scrape_yard,
+                            location_name,
+                            incremental,
+                            predecode,
+                            max_workers
+                            ): location_name
+            for location_name in location_names
+        }
+        for future in as_completed(futures):
+            changes[futures[future]] = future.result()
+
+    # The workers only invalidated their own copies
+    inventory_manager.invalidate()
+    return changes
+
+
+# Scrapes the given pages of a yard concurrently.
+# Returns ({page index: table}, number of failed pages)
+def scrape_pages(location_name,
+                 url,
+                 page_indexes,
+                 page_count,
+                 max_workers,
+                 pages_done=0,
+                 report=print,
+                 progress=None,
+                 engine=None
+                 ):
+    page_data = {}
+    failed_pages = []
+
+    def page_done(page_index, status_code, table):
+        nonlocal pages_done
+        if table is not None:
+            page_data[page_index] = table
+            pages_done += 1
+            if progress:
+                progress(location_name, pages_done, page_count)
+        else:
+            # REQUEST FAILED
+            failed_pages.append(page_index)
+            url_failed_message = (
+                f"Failed to fetch page {page_index + 1} "
+                f"from the URL: {url}"
+                f"\nResponse Status: {status_code}\n"
+            )
+            report(url_failed_message)
+
+    if engine is not None:
+        # ALL PAGES IN FLIGHT AT ONCE ON THE ASYNC ENGINE
+        try:
+            engine.run(engine.scrape_pages(url, page_indexes, page_done))
+        except CancelledError:
+            report(f'{location_name} scrape cancelled.\n')
+            return page_data, len(page_indexes) - len(page_data)
+        return page_data, len(failed_pages)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(scrape_page,
+                            url,
+                            1 + page_index * PAGE_SIZE
+                            ): page_index
+            for page_index in page_indexes
+        }
+        for future in as_completed(futures):
+            page_done(futures[future], *future.result())
+
+    return page_data, len(failed_pages)
@@ -1,7 +1,7 @@
-import classfile
+import inventory
 
-spk_inventory = classfile.Inventory('Spokane_inventory.csv')
-md_inventory = classfile.Inventory('Mead_inventory.csv')
+spk_inventory = inventory.Inventory('Spokane_inventory.csv')
+md_inventory = inventory.Inventory('Mead_inventory.csv')
 
 print(spk_inventory.search(year='2004', make='subaru', model='legacy', displacement=3.0))
 print(spk_inventory.search(year='1995', make='subaru', model='impreza'))
@@ -20,4 +20,7 @@ print(spk_inventory.search(year=1995, displacement=4.4))
 print(spk_inventory.search(make='mercedes', cylinders=6))
 print(spk_inventory.search(make='volkswagen', displacement=3.2))
 print(spk_inventory.search(make='bmw', displacement=2.5))
+print(spk_inventory.search(year='2000-2005', make='subaru'))
+print(spk_inventory.search(make='subaru', displacement='2.0-2.5'))
+print(spk_inventory.api_search_count(year='2000-2005', make='subaru'))
 print(spk_inventory.search())
@@ -0,0 +1,106 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from inventory import Inventory, Query
+
+# Saved searches that are checked against the vehicles added by each
+# inventory update, instead of re-running every search on the whole yard.
+# Watches are stored by name in data_cache/watchlist.json with the same
+# filters as a search (year, make, model, displacement, cylinders,
+# location), matches are appended to data_cache/watch_matches.log.
+
+WATCHLIST_FILE = os.path.join('data_cache', 'watchlist.json')
+WATCH_LOG_FILE = os.path.join('data_cache', 'watch_matches.log')
+
+
+def load_watches():
+    if not os.path.exists(WATCHLIST_FILE):
+        return {}
+    with open(WATCHLIST_FILE) as file:
+        return json.load(file)
+
+
+def write_watches(watches):
+    if not os.path.exists('data_cache'):
+        os.makedirs('data_cache')
+    with open(WATCHLIST_FILE, 'w') as file:
+        json.dump(watches, file, indent=2)
+
+
+# Saves a search under a name, replacing a watch with the same name.
+# Empty filters are left out. Returns the watch's Query.
+def save_watch(name, **filters):
+    filters = {column: value for column, value in filters.items() if value}
+    # Raises on filters a search wouldn't accept, e.g. a year of 'abc'
+    query = Query(**filters)
+    if not query.predicates:
+        raise ValueError('A watch needs at least one search filter')
+    watches = load_watches()
+    watches[name] = filters
+    write_watches(watches)
+    return query
+
+
+def remove_watch(name):
+    watches = load_watches()
+    if watches.pop(name, None) is None:
+        return False
+    write_watches(watches)
+    return True
+
+
+# Checks every watch against the vehicles an update added to a yard.
+# Arrivals are indexed once and only the ones an engine watch could match
+# are decoded, once for all watches.
+# Returns {watch name: matching vehicles}
+def check_watches(location_name, added, engine=None, report=print):
+    watches = load_watches()
+    if not watches or added.empty:
+        return {}
+
+    arrivals = Inventory(f'{location_name}_arrivals.csv', added)
+    queries = {name: Query(**filters) for name, filters in watches.items()}
+    positions = {name: arrivals.inventory_positions(query)
+                 for name, query in queries.items()}
+
+    decode_positions = [positions[name] for name, query in queries.items()
+                        if query.needs_decode()]
+    if decode_positions:
+        decoded = Inventory.decode_engines(
+            arrivals.inventory.iloc[np.unique(np.concatenate(
+                decode_positions
+            ))],
+            engine
+        )
+
+    matches = {}
+    for name, query in queries.items():
+        rows = arrivals.inventory.iloc[positions[name]]
+        if query.needs_decode():
+            rows = decoded[decoded.index.isin(rows.index)]
+            rows = rows[Query.mask(rows, query.engine_predicates())]
+        if not rows.empty:
+            matches[name] = rows
+
+    log_matches(location_name, matches, report)
+    return matches
+
+
+# Reports watch matches and appends them to the watch log
+def log_matches(location_name, matches, report=print):
+    if not matches:
+        return
+    now = pd.Timestamp.now().isoformat(timespec='seconds')
+    lines = [
+        f'{now} {location_name} "{name}": {vehicle.Year} {vehicle.Make} '
+        f'{vehicle.Model} in row {vehicle.Row}, VIN {vehicle.Vin}'
+        for name, rows in matches.items()
+        for vehicle in rows.itertuples()
+    ]
+    with open(WATCH_LOG_FILE, 'a') as file:
+        file.write(''.join(f'{line}\n' for line in lines))
+
+    match_count = sum(rows.shape[0] for rows in matches.values())
+    report(f'\n{match_count} watchlist matches in the new {location_name} '
+           f'vehicles:\n' + '\n'.join(lines) + '\n')